@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import re
+from collections import OrderedDict
+
+from constants import CANONICAL_MEMO_MAX_ENTRIES
+
+
+TOKEN_RE = re.compile(r'\w+(?:-\d+)*', re.UNICODE)
+ORDINAL_RE = re.compile(r'^(\d+)(?:st|nd|rd|th)$')
+APOSTROPHE_RE = re.compile(u"['’`]", re.UNICODE)
+
+STREET_ABBREVIATIONS = {'street': 'st', 'str': 'st', 'avenue': 'ave', 'av': 'ave', 'avn': 'ave',
+                        'boulevard': 'blvd', 'blv': 'blvd', 'road': 'rd', 'place': 'pl', 'parkway': 'pkwy',
+                        'pky': 'pkwy', 'drive': 'dr', 'lane': 'ln', 'court': 'ct', 'terrace': 'ter',
+                        'highway': 'hwy', 'expressway': 'expy', 'turnpike': 'tpke', 'square': 'sq',
+                        'plaza': 'plz', 'east': 'e', 'west': 'w', 'north': 'n', 'south': 's'}
+
+ORDINAL_WORDS = {'first': '1', 'second': '2', 'third': '3', 'fourth': '4', 'fifth': '5', 'sixth': '6',
+                    'seventh': '7', 'eighth': '8', 'ninth': '9', 'tenth': '10', 'eleventh': '11', 'twelfth': '12'}
+
+# a designator and the token after it (apt 3b, ste 200) name a unit, not the building.
+UNIT_DESIGNATORS = frozenset(['apt', 'apartment', 'unit', 'ste', 'suite', 'rm', 'room', 'store', 'stall', 'space'])
+
+# these come after or before their floor (2nd fl, fl 2); both are dropped.
+FLOOR_DESIGNATORS = frozenset(['fl', 'flr', 'floor', 'bsmt', 'basement'])
+
+
+def canonical_address(address):
+    '''Lowercased street address as space separated tokens, with street types
+    and directionals abbreviated (West 45th Street -> w 45 st), ordinals as
+    plain numbers, and apartment, suite and floor designations dropped.'''
+
+    if address is None:
+        return None
+
+    # doh values are utf-8 byte strings; matched byte by byte, \w would split é.
+    if isinstance(address, str):
+        address = address.decode('utf-8', 'replace')
+
+    # '#' only ever marks a unit: # 4, #4b.
+    address = re.sub(r'#\s*\w*', ' ', address.lower(), flags = re.UNICODE)
+    tokens = TOKEN_RE.findall(address)
+
+    canonical_tokens = []
+    skip_next = False
+    for token in tokens:
+
+        if skip_next:
+            skip_next = False
+            continue
+
+        if token in UNIT_DESIGNATORS:
+            skip_next = True
+            continue
+
+        if token in FLOOR_DESIGNATORS:
+            # the floor number, unless it is all we have (a house number).
+            if len(canonical_tokens) > 1 and (canonical_tokens[-1].isdigit() or canonical_tokens[-1] == 'ground'):
+                canonical_tokens.pop()
+            else:
+                skip_next = True
+            continue
+
+        ordinal = ORDINAL_RE.match(token)
+        if ordinal:
+            token = ordinal.group(1)
+
+        canonical_tokens.append(ORDINAL_WORDS.get(token) or STREET_ABBREVIATIONS.get(token, token))
+
+    return ' '.join(canonical_tokens)
+
+
+def canonical_name(name):
+    '''Lowercased business name as space separated tokens: apostrophes
+    dropped (joe's -> joes), '&' spelled out, other punctuation folded into
+    spaces.'''
+
+    if name is None:
+        return None
+
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+
+    name = APOSTROPHE_RE.sub('', name.lower()).replace('&', ' and ')
+    return ' '.join(TOKEN_RE.findall(name))
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class LruMemo(object):
+    '''Memoizes a one argument function in an in-memory LRU of at most
+    max_entries results, keyed on the argument. Counts hits and misses.
+
+    Pickles without its entries, so a copy sent to a pool worker starts
+    empty rather than shipping the parent's memo with every chunk.'''
+
+    def __init__(self, function, max_entries = CANONICAL_MEMO_MAX_ENTRIES):
+
+        self.function = function
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, key):
+
+        try:
+            value = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = self.function(key)
+            self.misses += 1
+            if len(self.entries) >= self.max_entries:
+                self.entries.popitem(last = False)
+
+        # re-inserted, so the least recently used entry is always first.
+        self.entries[key] = value
+        return value
+
+    def __getstate__(self):
+
+        return {'function': self.function, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+
+        self.__init__(**state)
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class AddressCanonicalizer(object):
+    '''canonical_address and canonical_name, each memoized on the raw
+    string, so a doh or yelp value seen across many candidate pairs is
+    canonicalized once per run.'''
+
+    def __init__(self, max_entries = CANONICAL_MEMO_MAX_ENTRIES):
+
+        self.address = LruMemo(canonical_address, max_entries)
+        self.name = LruMemo(canonical_name, max_entries)
+
+    def report(self, n_workers = 1):
+
+        if n_workers > 1:
+            # workers get empty copies (see LruMemo), and their counts die with them.
+            print "Canonicalization in {0} pool workers is not counted below.".format(n_workers)
+
+        for kind, memo in (('address', self.address), ('name', self.name)):
+            print "{0} memo: {1} hits, {2} misses, {3} entries.".format(kind, memo.hits, memo.misses, len(memo.entries))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+
+from constants import RAW_INSPECTION_CSV_PATH
+from inspection_data_machinery import InspectionDataCleaner
+
+
+def extracts_footprint(extracts):
+    '''Bytes held by the extract list, its tuples and their field values,
+    counting each distinct object once.'''
+
+    seen = set()
+    total = sys.getsizeof(extracts)
+
+    for extract in extracts:
+        for obj in (extract,) + tuple(extract):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+
+    return total
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', help = 'Raw inspection csv to clean.', required = False)
+
+    parser.set_defaults(path = RAW_INSPECTION_CSV_PATH)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    plain_extracts = InspectionDataCleaner(cache_path = None, intern_strings = False).clean(args.path)
+    plain_footprint = extracts_footprint(plain_extracts)
+    del plain_extracts
+
+    interned_extracts = InspectionDataCleaner(cache_path = None, intern_strings = True).clean(args.path)
+    interned_footprint = extracts_footprint(interned_extracts)
+
+    print "{0} extracts.".format(len(interned_extracts))
+    print "Without interning: {0:>10.1f} MB".format(plain_footprint / 2.0**20)
+    print "With interning:    {0:>10.1f} MB".format(interned_footprint / 2.0**20)
+    print "Reduction: {0:.0%}".format(1 - float(interned_footprint) / plain_footprint)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from Queue import Empty
+import BaseHTTPServer
+import SimpleHTTPServer
+
+from inspection_data_machinery import InspectionDataRetriever, InspectionDataCleaner
+from synthetic_inspection_data import SyntheticInspectionDataGenerator
+
+
+class LocalFileServer(object):
+    '''Serves the files in a directory over http on a free local port, in a 
+    daemon thread.'''
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+    def __enter__(self):
+
+        directory = self.directory
+
+        class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+            def translate_path(self, path):
+                return os.path.join(directory, path.lstrip('/').split('?')[0])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def url(self, file_name):
+
+        return 'http://127.0.0.1:{0}/{1}'.format(self.server.server_address[1], file_name)
+
+    def __exit__(self, type, value, traceback):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+def retrieve_stage(data_url, write_path):
+
+    InspectionDataRetriever().stream_retrieve(data_url, write_path)
+
+
+def clean_stage(read_path, n_workers):
+
+    cleaner = InspectionDataCleaner(n_workers = n_workers, cache_path = None)
+    for _ in cleaner.clean_iter(read_path):
+        pass
+
+
+def load_stage(read_path, load_method):
+
+    # imported here so the retrieve and clean stages run without a database.
+    from table_builders import DohTablesLoader
+
+    loader = DohTablesLoader()
+    loader.create_tables()
+    loader.add_records(InspectionDataCleaner(cache_path = None).clean_iter(read_path), load_method = load_method)
+
+
+def _run_stage(queue, stage, args):
+
+    try:
+        start = time.time()
+        stage(*args)
+        elapsed = time.time() - start
+
+        # the cleaner's pool workers hold rows of their own; RUSAGE_CHILDREN 
+        # covers them once they have exited (the largest, not the sum).
+        max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 
+                                        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        queue.put((elapsed, max_rss))
+
+    except Exception as e:
+        queue.put(e)
+        raise
+
+
+def run_stage(stage, *args):
+    '''Run the stage in a fresh process so each one reports its own peak RSS 
+    (the larger of the stage process' and any worker process').'''
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _run_stage, args = (queue, stage, args))
+    process.start()
+
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout = 1)
+        except Empty:
+            # a child killed outright (the oom killer, a segfault) never puts a result.
+            if not process.is_alive():
+                try:
+                    result = queue.get(timeout = 1)
+                except Empty:
+                    process.join()
+                    raise RuntimeError('{0} exited with code {1} without a result.'.format(
+                                        stage.__name__, process.exitcode))
+    process.join()
+
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def report(name, n_rows, elapsed, max_rss):
+
+    # ru_maxrss is in kilobytes on linux.
+    print "{0:<28} {1:>8.2f} s {2:>12,.0f} rows/sec {3:>10.1f} MB peak RSS".format(
+                                        name, elapsed, n_rows / elapsed, max_rss / 1024.0)
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_rows', help = 'Number of synthetic inspection rows.', required = False)
+    parser.add_argument('-s', '--seed', help = 'Synthetic data seed.', required = False)
+    parser.add_argument('-w', '--workers', help = 'Worker counts to clean with, e.g. 1,4.', required = False)
+    parser.add_argument('-l', '--load', help = 'Also time loads into the local postgres. DROPS the doh tables.',
+                                        dest = 'load', action = 'store_true')
+
+    parser.set_defaults(n_rows = 100000, seed = 0, workers = '1,{0}'.format(multiprocessing.cpu_count()), load = False)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    n_rows = int(args.n_rows)
+    work_dir = tempfile.mkdtemp()
+
+    try:
+
+        raw_path = os.path.join(work_dir, 'synthetic_inspection_data.csv')
+        SyntheticInspectionDataGenerator(seed = int(args.seed)).write(raw_path, n_rows)
+        print "{0:,} synthetic rows, {1:.1f} MB.".format(n_rows, os.path.getsize(raw_path) / 2.0**20)
+
+        with LocalFileServer(work_dir) as server:
+            retrieved_path = os.path.join(work_dir, 'retrieved.csv')
+            report('retrieve', n_rows, *run_stage(retrieve_stage, server.url('synthetic_inspection_data.csv'), retrieved_path))
+
+        for n_workers in sorted(set(int(w) for w in args.workers.split(','))):
+            report('clean ({0} workers)'.format(n_workers), n_rows, *run_stage(clean_stage, raw_path, n_workers))
+
+        if args.load:
+            from table_builders import COPY_LOAD, VALUES_LOAD, EXECUTEMANY_LOAD
+            for load_method in (COPY_LOAD, VALUES_LOAD, EXECUTEMANY_LOAD):
+                report('clean + load ({0})'.format(load_method), n_rows, *run_stage(load_stage, raw_path, load_method))
+
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+import csv
+
+from constants import RAW_INSPECTION_CSV_PATH
+from inspection_data_machinery import InspectionRecordCleaner, CompiledRecordCleaner, InspectionDataCleaner
+
+
+def read_rows(read_path):
+
+    with open(read_path, 'rt') as f:
+
+        fmtparams = InspectionDataCleaner()._sniff_fmtparams(f)
+        reader = csv.reader(f, **fmtparams)
+        header = reader.next()
+        rows = list(reader)
+
+    return header, rows
+
+
+def time_dispatch_cleaner(header, rows):
+
+    record_cleaner = InspectionRecordCleaner()
+
+    start = time.time()
+    for row in rows:
+        record_cleaner.clean(dict(zip(header, row)))
+    return time.time() - start
+
+
+def time_compiled_cleaner(header, rows):
+
+    start = time.time()
+    clean_row = CompiledRecordCleaner().compile(header)
+    for row in rows:
+        clean_row(row)
+    return time.time() - start
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', help = 'Raw inspection csv to clean.', required = False)
+    parser.add_argument('-r', '--repeat', help = 'Number of timed runs per cleaner.', required = False)
+
+    parser.set_defaults(path = RAW_INSPECTION_CSV_PATH, repeat = 3)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    # rows are read once up front so only the cleaning itself is timed.
+    header, rows = read_rows(args.path)
+    repeat = int(args.repeat)
+
+    dispatch_time = min(time_dispatch_cleaner(header, rows) for _ in range(repeat))
+    compiled_time = min(time_compiled_cleaner(header, rows) for _ in range(repeat))
+
+    print "{0} rows, best of {1}.".format(len(rows), repeat)
+    print "FieldCleaners dispatch: {0:>12,.0f} rows/sec".format(len(rows) / dispatch_time)
+    print "CompiledRecordCleaner:  {0:>12,.0f} rows/sec".format(len(rows) / compiled_time)
+    print "Speedup: {0:.1f}x".format(dispatch_time / compiled_time)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+
+from constants import YELP_RESPONSE_CACHE_PATH
+from yelp_api_machinery import YelpApiResponseParser
+from mock_yelp_api import synthetic_business, search_response
+
+
+def recorded_responses(cache_path):
+    '''Response bodies saved by YelpResponseCache.'''
+
+    conn = sqlite3.connect(cache_path)
+    try:
+        return [str(row[0]) for row in conn.execute('SELECT response_json FROM responses;')]
+    finally:
+        conn.close()
+
+
+def synthetic_responses(n_responses, seed = 0):
+
+    rng = random.Random(seed)
+    return [json.dumps(search_response([synthetic_business(rng) for _ in range(rng.randint(1, 15))]))
+                for _ in range(n_responses)]
+
+
+def time_parse(parser, decode, responses):
+
+    start = time.time()
+    n_extracts = 0
+    for body in responses:
+        n_extracts += len(parser.parse(decode(body)))
+    return time.time() - start, n_extracts
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', help = 'Response cache to read recorded responses from.', required = False)
+    parser.add_argument('-n', '--n_responses', help = 'Synthetic responses to use when there is no cache.', required = False)
+    parser.add_argument('-r', '--repeat', help = 'Number of timed runs per decoder.', required = False)
+
+    parser.set_defaults(path = YELP_RESPONSE_CACHE_PATH, n_responses = 5000, repeat = 3)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        responses = recorded_responses(args.path)
+        print "{0} recorded responses from {1}.".format(len(responses), args.path)
+    else:
+        responses = synthetic_responses(int(args.n_responses))
+        print "{0} synthetic responses.".format(len(responses))
+
+    response_parser = YelpApiResponseParser()
+    repeat = int(args.repeat)
+
+    decoders = [('json', json.loads), ('YelpApiResponseParser.decode', response_parser.decode)]
+    for name, decode in decoders:
+
+        elapsed, n_extracts = min(time_parse(response_parser, decode, responses) for _ in range(repeat))
+        print "{0:<30} {1:>10,.0f} responses/sec {2:>12,.0f} extracts/sec".format(
+                                        name, len(responses) / elapsed, n_extracts / elapsed)
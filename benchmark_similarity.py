@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import random
+import re
+import time
+from difflib import SequenceMatcher
+
+from constants import LOWER_SIMILARITY_THRESHOLD, UPPER_SIMILARITY_THRESHOLD, \
+                    ADDRESS_SCORE_WEIGHT, NAME_SCORE_WEIGHT
+from inspection_data_machinery import CompiledRecordCleaner, RestaurantAggregator
+from synthetic_inspection_data import SyntheticInspectionDataGenerator, DOH_CSV_HEADER
+from yelp_api_machinery import RestaurantYelpExtract
+from extract_matchers import ByAddressExtractMatcher
+from address_canonicalizer import canonical_address, canonical_name
+
+
+def lowercase(text):
+
+    return text.lower().strip()
+
+
+def sequence_matcher_score(doh_extract, yelp_extract, normalize_address = canonical_address, normalize_name = canonical_name):
+    '''ByAddressExtractMatcher._score_extract computing both full ratios for
+    every pair, as it did before the bounds, with the canonicalization left
+    unmemoized (or, given lowercase, as it was before canonicalization).'''
+
+    def similarity_score(a, b, normalize):
+        if a is None or b is None:
+            return 0
+        return SequenceMatcher(None, normalize(a), normalize(b)).ratio()
+
+    address_score = similarity_score(doh_extract.doh_address, yelp_extract.yelp_address, normalize_address)
+    name_score = similarity_score(doh_extract.doh_dba, yelp_extract.yelp_name, normalize_name)
+
+    if min(address_score, name_score) >= LOWER_SIMILARITY_THRESHOLD and \
+        max(address_score, name_score) >= UPPER_SIMILARITY_THRESHOLD:
+        return (ADDRESS_SCORE_WEIGHT*address_score + NAME_SCORE_WEIGHT*name_score)
+
+    return 0
+
+
+def ordinal(number):
+
+    if 10 <= int(number) % 100 < 20:
+        return number + 'th'
+    return number + {'1': 'st', '2': 'nd', '3': 'rd'}.get(number[-1], 'th')
+
+
+def perturb(rng, text):
+    '''A yelp style rendering of a doh value: different case, an abbreviation,
+    an ordinal suffix on a street number or a dropped character.'''
+
+    text = text.title()
+    for long_form, short_form in (('Street', 'St'), ('Avenue', 'Ave'), ('Boulevard', 'Blvd'), 
+                                    ('East ', 'E '), ('West ', 'W ')):
+        if rng.random() < .5:
+            text = text.replace(long_form, short_form)
+    if rng.random() < .5:
+        # numbers after the first word: 8 Avenue -> 8th Avenue, not the house number.
+        text = re.sub(r'(?<= )\d+\b', lambda number: ordinal(number.group()), text)
+    if text and rng.random() < .3:
+        i = rng.randrange(len(text))
+        text = text[:i] + text[i + 1:]
+    return text
+
+
+def scoring_pairs(n_rows, n_candidates, seed):
+    '''(doh restaurant, yelp extract) pairs like an address search returns:
+    one candidate is the restaurant itself, as yelp might list it, the rest
+    are its neighbours. Also returns, per pair, whether it is the former.'''
+
+    rng = random.Random(seed)
+
+    clean_row = CompiledRecordCleaner().compile(DOH_CSV_HEADER)
+    aggregator = RestaurantAggregator()
+    for _ in aggregator.consume(clean_row(row) for row in SyntheticInspectionDataGenerator(seed = seed).rows(n_rows)):
+        pass
+    restaurants = [r for r in aggregator.summaries() if r.doh_dba and r.doh_address]
+
+    def yelp_extract(restaurant, same):
+        name, address = restaurant.doh_dba, restaurant.doh_address
+        if same:
+            name, address = perturb(rng, name), perturb(rng, address)
+        return RestaurantYelpExtract(name, '', address, '', '', '', 0, 0., [], [])
+
+    pairs = []
+    same = []
+    for restaurant in restaurants:
+        pairs.append((restaurant, yelp_extract(restaurant, True)))
+        same.append(True)
+        for neighbour in rng.sample(restaurants, min(n_candidates - 1, len(restaurants))):
+            pairs.append((restaurant, yelp_extract(neighbour, False)))
+            same.append(False)
+
+    return pairs, same
+
+
+def time_scorer(score, pairs):
+
+    start = time.time()
+    scores = [score(doh_extract, yelp_extract) for doh_extract, yelp_extract in pairs]
+    return time.time() - start, scores
+
+
+def acceptance(scores, same):
+    '''How many of the restaurants' own renderings, and how many other
+    candidates, scored above 0.'''
+
+    n_same = sum(1 for score, is_same in zip(scores, same) if score > 0 and is_same)
+    n_other = sum(1 for score, is_same in zip(scores, same) if score > 0 and not is_same)
+    return n_same, n_other
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_rows', help = 'Synthetic inspection rows to draw restaurants from.', required = False)
+    parser.add_argument('-c', '--n_candidates', help = 'Yelp candidates scored per restaurant.', required = False)
+    parser.add_argument('-r', '--repeat', help = 'Number of timed runs per scorer.', required = False)
+    parser.add_argument('-s', '--seed', help = 'Synthetic data seed.', required = False)
+
+    parser.set_defaults(n_rows = 50000, n_candidates = 15, repeat = 3, seed = 0)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    pairs, same = scoring_pairs(int(args.n_rows), int(args.n_candidates), int(args.seed))
+    repeat = int(args.repeat)
+
+    reference_time, reference_scores = min(time_scorer(sequence_matcher_score, pairs) for _ in range(repeat))
+    # a fresh matcher per run, so the canonicalization memo starts cold each time.
+    bounded_time, bounded_scores = min(time_scorer(ByAddressExtractMatcher()._score_extract, pairs) for _ in range(repeat))
+    _, lowercase_scores = time_scorer(lambda d, y: sequence_matcher_score(d, y, lowercase, lowercase), pairs)
+
+    # the bounds only skip work, so every score, not just the decision, must agree.
+    assert bounded_scores == reference_scores
+
+    n_same, n_other = acceptance(bounded_scores, same)
+    n_lowercase_same, n_lowercase_other = acceptance(lowercase_scores, same)
+
+    print "{0} pairs, best of {1}.".format(len(pairs), repeat)
+    print "Accepted, canonicalized:  {0} of {1} same restaurant, {2} others.".format(n_same, sum(same), n_other)
+    print "Accepted, lowercase only: {0} of {1} same restaurant, {2} others.".format(n_lowercase_same, sum(same), n_lowercase_other)
+    print "SequenceMatcher:         {0:>8.2f} us/pair".format(reference_time / len(pairs) * 1e6)
+    print "ByAddressExtractMatcher: {0:>8.2f} us/pair".format(bounded_time / len(pairs) * 1e6)
+    print "Speedup: {0:.1f}x".format(reference_time / bounded_time)
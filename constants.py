@@ -4,6 +4,9 @@
 RAW_INSPECTION_CSV_URL = 'https://data.cityofnewyork.us/api/views/xx67-kt59/rows.csv?accessType=DOWNLOAD'
 RAW_INSPECTION_CSV_PATH = './raw_inspection_data.csv'
 CLEAN_INSPECTION_CSV_PATH = './cleaned_inspection_data.csv'
+CLEAN_INSPECTION_CACHE_PATH = CLEAN_INSPECTION_CSV_PATH + '.columns'
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 # yelp api
 SEARCH_ADDR_BASE_URL = 'http://api.yelp.com/v2/search'
@@ -11,6 +14,18 @@ SEARCH_PHONE_BASE_URL = 'http://api.yelp.com/v2/phone_search'
 
 MAX_GET_ATTEMPTS = 3
 
+RETRY_BACKOFF_BASE = 1.0 # seconds
+RETRY_BACKOFF_MAX = 60.0 # seconds
+RETRY_AFTER_MAX = 300.0 # seconds, cap on a server's Retry-After
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+YELP_DAILY_QUOTA = 25000
+QUOTA_WINDOW = 24 * 60 * 60 # seconds
+
+YELP_RESPONSE_CACHE_PATH = './yelp_response_cache.sqlite'
+YELP_RESPONSE_CACHE_TTL = 30 * 24 * 60 * 60 # seconds
+YELP_RESPONSE_CACHE_MAX_ENTRIES = 500000
+
 # extract matchers
 
 LOWER_SIMILARITY_THRESHOLD = .70
@@ -19,6 +34,15 @@ UPPER_SIMILARITY_THRESHOLD = .80
 ADDRESS_SCORE_WEIGHT = .75
 NAME_SCORE_WEIGHT = .25
 
+MATCH_CHUNK_SIZE = 500
+
+CANONICAL_MEMO_MAX_ENTRIES = 200000
+
+BLOCKING_MAX_BLOCK_SIZE = 500
+BLOCKING_MAX_CANDIDATES = 15
+
+TFIDF_NGRAM_SIZE = 3
+
 # database
 
 DB_NAME = 'yelp'
@@ -30,3 +54,8 @@ YELP_RESTAURANTS_TABLE_NAME = 'yelp_restaurants'
 YELP_CATEGORIES_TABLE_NAME = 'yelp_categories'
 YELP_REVIEWS_TABLE_NAME = 'yelp_reviews'
 YELP_NEIGHBORHOODS_TABLE_NAME = 'yelp_neighborhoods'
+YELP_PULL_PROGRESS_TABLE_NAME = 'yelp_pull_progress'
+
+INSERT_BATCH_SIZE = 5000
+CHECKPOINT_BATCH_SIZE = 100
+PIPELINE_QUEUE_SIZE = 4
@@ -1,19 +1,65 @@
 from difflib import SequenceMatcher
+from collections import namedtuple
+import itertools
+import multiprocessing
 from constants import LOWER_SIMILARITY_THRESHOLD, UPPER_SIMILARITY_THRESHOLD, \
-                    ADDRESS_SCORE_WEIGHT, NAME_SCORE_WEIGHT
+                    ADDRESS_SCORE_WEIGHT, NAME_SCORE_WEIGHT, MATCH_CHUNK_SIZE
 from operator import itemgetter
+from address_canonicalizer import AddressCanonicalizer
+
+
+# the only fields the address matcher reads, rebuilt in pool workers from 
+# the plain tuples shipped to them.
+CompactDohExtract = namedtuple('CompactDohExtract', ['doh_dba', 'doh_address'])
+CompactYelpExtract = namedtuple('CompactYelpExtract', ['yelp_name', 'yelp_address'])
+
+
+def _match_compact_chunk(args):
+    '''Pool worker: the best candidate index (or None) for each compact extract tuple.'''
+
+    matcher, compact_tuples = args
+    return [matcher._match_compact(compact_tuple) for compact_tuple in compact_tuples]
+
 
 class ExtractMatcher():
     '''Takes (Record, RestaurantExtractList) tuples and matches that Record
     with at most one of the restaurant extracts in the RestaurantExtractList.
     '''
 
-    def match_all(self, extract_tuples):
+    def match_all(self, extract_tuples, n_workers = 1, chunk_size = MATCH_CHUNK_SIZE):
+        '''With n_workers > 1, matchers that define _compact score chunk_size 
+        extract tuples at a time in a process pool. Only the fields scoring 
+        reads are shipped, as plain tuples, and only the index of each best 
+        candidate comes back; the matches are assembled here, in input order.'''
+
+        if n_workers > 1 and self._compact is not None:
+            matched_extract_tuples = self._match_all_parallel(list(extract_tuples), n_workers, chunk_size)
+        else:
+            matched_extract_tuples = filter(None, (self.match(extract_tuple) for extract_tuple in extract_tuples))
 
-        matched_extract_tuples = filter(None, (self.match(extract_tuple) for extract_tuple in extract_tuples))
         self._report_match_results(matched_extract_tuples)
         return matched_extract_tuples
 
+    # matchers that can score in a pool worker override this with a method 
+    # turning an extract tuple into plain tuples for _match_compact.
+    _compact = None
+
+    def _match_all_parallel(self, extract_tuples, n_workers, chunk_size):
+
+        chunks = (  (self, [self._compact(extract_tuple) for extract_tuple in extract_tuples[i:i + chunk_size]])
+                    for i in xrange(0, len(extract_tuples), chunk_size) )
+
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            best_indices = list(itertools.chain.from_iterable(pool.imap(_match_compact_chunk, chunks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        return [(doh_extract, yelp_extracts[best_index]) 
+                    for (doh_extract, yelp_extracts), best_index in zip(extract_tuples, best_indices)
+                    if best_index is not None]
+
     def match(self, extract_tuple):
         NotImplementedError
 
@@ -39,9 +85,20 @@ class ByPhoneExtractMatcher(ExtractMatcher):
 
 
 class ByAddressExtractMatcher(ExtractMatcher):
-
-    def __init__(self, similarity_threshold = .8):
+    '''Scores candidates by SequenceMatcher ratio of name and address. Most 
+    candidates fail the thresholds, so each ratio is first bounded from above 
+    by the strings' lengths and character counts (as SequenceMatcher's own 
+    real_quick_ratio and quick_ratio do, only cheaper), and the full ratio is 
+    only computed for pairs the bounds cannot rule out. Scores, and so 
+    decisions, are the same as always computing the full ratio.
+
+    Names and addresses are compared in canonical form (see 
+    address_canonicalizer), memoized on the raw strings, so 123 W 45TH ST 
+    and 123 West 45th Street score as equal.'''
+
+    def __init__(self, similarity_threshold = .8, canonicalizer = None):
         self.similarity_threshold = similarity_threshold
+        self.canonicalizer = canonicalizer or AddressCanonicalizer()
 
     def match(self, extract_tuple):
 
@@ -59,6 +116,27 @@ class ByAddressExtractMatcher(ExtractMatcher):
         return None    
 
         
+    def _compact(self, extract_tuple):
+
+        doh_extract, yelp_extracts = extract_tuple
+        return ((doh_extract.doh_dba, doh_extract.doh_address), 
+                tuple((yelp_extract.yelp_name, yelp_extract.yelp_address) for yelp_extract in yelp_extracts))
+
+    def _match_compact(self, compact_tuple):
+        '''match, for a _compact tuple: the index of the best candidate, or None.'''
+
+        doh_fields, yelp_fields = compact_tuple
+        doh_extract = tuple.__new__(CompactDohExtract, doh_fields)
+
+        best_index, best_score = None, 0
+        for i, fields in enumerate(yelp_fields):
+            # the first of equal scores wins, as in the stable sort of _score_extracts.
+            score = self._score_extract(doh_extract, tuple.__new__(CompactYelpExtract, fields))
+            if score > best_score:
+                best_index, best_score = i, score
+
+        return best_index
+
     def _score_extracts(self, doh_extract, yelp_extracts):    
 
         scored_extracts = [ (yelp_extract, self._score_extract(doh_extract, yelp_extract)) for yelp_extract in yelp_extracts]
@@ -67,13 +145,20 @@ class ByAddressExtractMatcher(ExtractMatcher):
 
     def _score_extract(self, doh_extract, yelp_extract):
 
-        target_address = doh_extract.doh_address
-        target_name = doh_extract.doh_dba
+        target_address = self.canonicalizer.address(doh_extract.doh_address)
+        target_name = self.canonicalizer.name(doh_extract.doh_dba)
 
-        candidate_address = yelp_extract.yelp_address
-        candidate_name = yelp_extract.yelp_name
+        candidate_address = self.canonicalizer.address(yelp_extract.yelp_address)
+        candidate_name = self.canonicalizer.name(yelp_extract.yelp_name)
+
+        if not self._may_pass(  self._similarity_bound(target_address, candidate_address),
+                                self._similarity_bound(target_name, candidate_name)):
+            return 0
 
         address_score = self._similarity_score(target_address, candidate_address)
+        if address_score < LOWER_SIMILARITY_THRESHOLD:
+            return 0
+
         name_score = self._similarity_score(target_name, candidate_name)
         
 
@@ -86,10 +171,34 @@ class ByAddressExtractMatcher(ExtractMatcher):
 
             return 0
 
+    def _may_pass(self, address_bound, name_bound):
+
+        return  min(address_bound, name_bound) >= LOWER_SIMILARITY_THRESHOLD and \
+                max(address_bound, name_bound) >= UPPER_SIMILARITY_THRESHOLD
+
     def _normalize(self, text):
 
         return text.lower().strip()
 
+    def _similarity_bound(self, a, b):
+        '''Upper bound on _similarity_score(a, b). The ratio is 2*M / (len(a) + len(b)) 
+        where M, the number of matched characters, is at most the shorter 
+        length, and at most the sum over characters of the smaller count.'''
+
+        if a is None or b is None:
+            return 0
+
+        a, b = self._normalize(a), self._normalize(b)
+        total = len(a) + len(b)
+        if not total:
+            return 1.
+
+        if 2. * min(len(a), len(b)) / total < LOWER_SIMILARITY_THRESHOLD:
+            return 2. * min(len(a), len(b)) / total
+
+        matches = sum(min(a.count(char), b.count(char)) for char in set(a))
+        return 2. * matches / total
+
 
     def _similarity_score(self, a, b):
         
@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import csv
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
 import psycopg2
 from psycopg2.extras import NamedTupleConnection
 import requests
 import re
+import os
+import json
+import multiprocessing
+import hashlib
+import mmap
+import struct
+import array
+import itertools
+import cPickle as pickle
+from cStringIO import StringIO
+import numpy as np
+from constants import MAX_GET_ATTEMPTS, DOWNLOAD_CHUNK_SIZE, CLEAN_INSPECTION_CACHE_PATH
 
 
 # MOVE TO constants
@@ -46,6 +58,55 @@ DOH_FIELDS = [  DOH_CAMIS_NAME,
 
 DohInspectionExtract = namedtuple('DohInspectionExtract', DOH_FIELDS)
 
+DOH_INSPECTION_COUNT_NAME = 'doh_inspection_count'
+DOH_LATEST_GRADE_NAME = 'doh_latest_grade'
+DOH_LATEST_GRADE_DATE_NAME = 'doh_latest_grade_date'
+
+DOH_RESTAURANT_FIELDS = [   DOH_CAMIS_NAME,
+                            DOH_DBA_NAME,
+                            DOH_ADDRESS_NAME,
+                            DOH_ZIPCODE_NAME,
+                            DOH_PHONE_NAME,
+                            DOH_INSPECTION_COUNT_NAME,
+                            DOH_LATEST_GRADE_NAME,
+                            DOH_LATEST_GRADE_DATE_NAME,
+                        ]
+
+DohRestaurantSummary = namedtuple('DohRestaurantSummary', DOH_RESTAURANT_FIELDS)
+
+# low cardinality fields repeated across a restaurant's violation rows, 
+# the compiled cleaner shares one string object per distinct value. The 
+# pool holds one entry per distinct value, so it is bounded by the number 
+# of restaurants (dba, address) or by small fixed vocabularies.
+INTERNED_FIELDS = [ DOH_DBA_NAME,
+                    DOH_ADDRESS_NAME,
+                    DOH_INSPECTION_TYPE_NAME,
+                    DOH_ACTION_NAME,
+                    DOH_VIOLATION_CODE_NAME,
+                  ]
+
+PART_FILE_SUFFIX = '.part'
+META_FILE_SUFFIX = '.meta'
+
+DBA_JUNK_CHAR = 'Â'
+NULL_INSPECTION_DATE = '01/01/1900'
+SHARD_SCAN_BLOCK_SIZE = 1 << 16
+# a cleaned shard comes back as one list, so its size bounds memory per shard.
+SHARD_MAX_BYTES = 1 << 24
+# sniffing a sample of the data can pick a letter out of the violation 
+# descriptions as the delimiter, so candidates are restricted.
+SNIFF_DELIMITERS = ',\t'
+CACHE_MAGIC = 'DOHCOL01'
+# bump whenever cleaning changes what comes out (FieldCleaners, the record 
+# layout), so caches of the old output are not read back.
+CLEANER_VERSION = 1
+CACHE_DECODE_BLOCK_SIZE = 1 << 14
+ZIPCODE_RE = re.compile('^\d{5}$')
+PHONE_RE = re.compile('^[\d +-]+$')
+PHONE_PUNCTUATION_RE = re.compile('[ +-]')
+GRADE_RE = re.compile('^[A-Z]$')
+WHITESPACE_RE = re.compile('\s+')
+
 class InspectionDataRetriever:
 
 
@@ -59,27 +120,113 @@ class InspectionDataRetriever:
         with open(data_local_path, 'w') as f:
             f.write(self.data)
 
+    def stream_retrieve(self, data_url, data_local_path):
+        '''Stream the export straight to data_local_path in chunks instead of 
+        holding it in memory. A partial download left in the .part file by a 
+        dropped connection is resumed with a Range request, and the ETag / 
+        Last-Modified of the last complete download are sent back so an 
+        unchanged export is not downloaded again. 
+        Returns True if new data was written, False if the export was unchanged.'''
 
+        for _ in range(MAX_GET_ATTEMPTS):
 
-class FieldCleaners(object):
+            try:
+                return self._stream_to_part(data_url, data_local_path)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                print "Connection dropped, resuming download from byte {0}.".format(
+                                    self._part_size(data_local_path + PART_FILE_SUFFIX))
 
+        raise IOError("Could not retrieve {0} in {1} attempts.".format(data_url, MAX_GET_ATTEMPTS))
+
+    def _stream_to_part(self, data_url, data_local_path):
+
+        part_path = data_local_path + PART_FILE_SUFFIX
+        offset = self._part_size(part_path)
+        headers = {}
+
+        if offset > 0:
+            # only resume if the part came from the version still being served.
+            part_validators = self._read_validators(part_path)
+            if_range = part_validators.get('etag') or part_validators.get('last_modified')
+            if if_range:
+                headers['Range'] = 'bytes={0}-'.format(offset)
+                headers['If-Range'] = if_range
+
+        elif os.path.exists(data_local_path):
+            validators = self._read_validators(data_local_path)
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        r = requests.get(data_url, headers = headers, stream = True)
+
+        try:
+
+            if r.status_code == 304:
+                return False
+
+            if r.status_code == 416:
+                # the part no longer lines up with the export, start over.
+                self._discard_part(part_path)
+                return self._stream_to_part(data_url, data_local_path)
+
+            if r.status_code == 206:
+                mode = 'ab'
+            else:
+                r.raise_for_status()
+                mode = 'wb'
+                self._write_validators(part_path, {   
+                                            'etag': r.headers.get('ETag'),
+                                            'last_modified': r.headers.get('Last-Modified')
+                                            })
+
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size = DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+
+        finally:
+            r.close()
+
+        os.rename(part_path, data_local_path)
+        os.rename(part_path + META_FILE_SUFFIX, data_local_path + META_FILE_SUFFIX)
+        return True
+
+    def _part_size(self, part_path):
+
+        return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    def _discard_part(self, part_path):
+
+        for path in (part_path, part_path + META_FILE_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def validators(self, data_local_path):
+        '''The ETag / Last-Modified the complete download at data_local_path 
+        was served with ({} if unknown).'''
+
+        return self._read_validators(data_local_path)
+
+    def _read_validators(self, path):
+
+        meta_path = path + META_FILE_SUFFIX
+        if not os.path.exists(meta_path):
+            return {}
+
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def _write_validators(self, path, validators):
+
+        with open(path + META_FILE_SUFFIX, 'w') as f:
+            json.dump(validators, f)
+
+
+
+class FieldCleaners(object):
 
-    FN_TABLE = {                
-                DOH_CAMIS_NAME:            FieldCleaners.standard_clean_factory('CAMIS') ,
-                DOH_DBA_NAME:              FieldCleaners.dba_clean ,
-                DOH_ADDRESS_NAME:          FieldCleaners.addr_clean ,
-                DOH_ZIPCODE_NAME:          FieldCleaners.zipcode_clean ,
-                DOH_PHONE_NAME,:           FieldCleaners.phone_clean , 
-                DOH_INSPECTION_TYPE_NAME:  FieldCleaners.standard_clean_factory('INSPECTION TYPE') ,
-                DOH_INSPECTION_DATE_NAME:  FieldCleaners.inspection_date_clean ,
-                DOH_ACTION_NAME:           FieldCleaners.action_clean ,
-                DOH_SCORE_NAME:            FieldCleaners.standard_clean_factory('SCORE') ,
-                DOH_GRADE_NAME:            FieldCleaners.grade_clean ,
-                DOH_GRADE_DATE_NAME:       FieldCleaners.standard_clean_factory('GRADE DATE') ,
-                DOH_VIOLATION_CODE_NAME:   FieldCleaners.standard_clean_factory('VIOLATION CODE') ,
-                DOH_CRITICAL_FLAG_NAME:    FieldCleaners.critical_flag_clean ,
-                DOH_RECORD_DATE_NAME:      FieldCleaners.standard_clean_factory('RECORD DATE') ,  
-                }
 
     ACTION_MAP = {
                     'No violations were recorded at the time of this inspection.':'No violations cited.',
@@ -89,10 +236,10 @@ class FieldCleaners(object):
 
 
     @staticmethod
-    standard_clean_factory(field_name):
+    def standard_clean_factory(field_name):
 
         def standard_clean(record):
-            val = record.get(field_namE)
+            val = record.get(field_name)
             return val if val else NULL
 
         return standard_clean
@@ -109,30 +256,26 @@ class FieldCleaners(object):
     def dba_clean(record):
         
         raw_str = record.get('DBA')
-        return raw_str.replace('Â', '') if raw_str.strip() else NULL
+        return raw_str.replace(DBA_JUNK_CHAR, '') if raw_str.strip() else NULL
 
     @staticmethod
     def zipcode_clean(record):
 
         zipcode = record.get('ZIPCODE')
-        r = re.compile('^\d{5}$')
         zipcode = zipcode.strip()
-        return zipcode if r.match(zipcode) else NULL
+        return zipcode if ZIPCODE_RE.match(zipcode) else NULL
 
     @staticmethod
     def phone_clean(record):
 
         phone = record.get('PHONE')
-        r = re.compile('^[\d +-]+$')
-        r_replace = re.compile('[ +-]')
-        return r_replace.sub('', phone) if r.match(phone) else NULL
+        return PHONE_PUNCTUATION_RE.sub('', phone) if PHONE_RE.match(phone) else NULL
 
     @staticmethod    
     def grade_clean(record):
 
         grade = record.get('GRADE')
-        r = re.compile('^[A-Z]$')
-        return grade.strip() if r.match(grade.strip()) else NULL
+        return grade.strip() if GRADE_RE.match(grade.strip()) else NULL
 
     @staticmethod
     def action_clean(record):
@@ -159,17 +302,33 @@ class FieldCleaners(object):
 
         building = record.get('BUILDING')
         street = record.get('STREET')
-        r = re.compile('\s+')
         addr = ' '.join((building, street))
-        return r.sub(' ', addr).strip()
+        return WHITESPACE_RE.sub(' ', addr).strip()
 
     @staticmethod
     def inspection_date_clean(record):
         
         inspection_date = record.get('INSPECTION DATE')
-        return inspection_date if inspection_date != '01/01/1900' else NULL        
+        return inspection_date if inspection_date != NULL_INSPECTION_DATE else NULL        
 
 
+FieldCleaners.FN_TABLE = {                
+                DOH_CAMIS_NAME:            FieldCleaners.standard_clean_factory('CAMIS') ,
+                DOH_DBA_NAME:              FieldCleaners.dba_clean ,
+                DOH_ADDRESS_NAME:          FieldCleaners.addr_clean ,
+                DOH_ZIPCODE_NAME:          FieldCleaners.zipcode_clean ,
+                DOH_PHONE_NAME:            FieldCleaners.phone_clean , 
+                DOH_INSPECTION_TYPE_NAME:  FieldCleaners.standard_clean_factory('INSPECTION TYPE') ,
+                DOH_INSPECTION_DATE_NAME:  FieldCleaners.inspection_date_clean ,
+                DOH_ACTION_NAME:           FieldCleaners.action_clean ,
+                DOH_SCORE_NAME:            FieldCleaners.standard_clean_factory('SCORE') ,
+                DOH_GRADE_NAME:            FieldCleaners.grade_clean ,
+                DOH_GRADE_DATE_NAME:       FieldCleaners.standard_clean_factory('GRADE DATE') ,
+                DOH_VIOLATION_CODE_NAME:   FieldCleaners.standard_clean_factory('VIOLATION CODE') ,
+                DOH_CRITICAL_FLAG_NAME:    FieldCleaners.critical_flag_clean ,
+                DOH_RECORD_DATE_NAME:      FieldCleaners.standard_clean_factory('RECORD DATE') ,  
+                }
+
 
 
 class InspectionRecordCleaner(object):
@@ -177,36 +336,475 @@ class InspectionRecordCleaner(object):
     @staticmethod
     def clean(record):
 
-        cleaned = { doh_field : FieldCleaners.clean(doh_field, record)} for doh_field in DOH_FIELDS }
+        cleaned = { doh_field : FieldCleaners.clean(doh_field, record) for doh_field in DOH_FIELDS }
 
-        return DohInspectionExtract._make(cleaned)
+        return DohInspectionExtract(**cleaned)
 
 
 
 
-class InspectionDataCleaner:
+class CompiledRecordCleaner(object):
+    '''Builds, once per csv header, a single function that turns a raw csv row 
+    straight into a DohInspectionExtract. Column indices are resolved up front 
+    and the per field logic of FieldCleaners is inlined, so there is no 
+    dict(zip(header, row)) and no FN_TABLE lookup per field.'''
+
+    # (raw csv columns, statement assigning the cleaned value to {out})
+    FIELD_TEMPLATES = {
+                DOH_CAMIS_NAME:            (('CAMIS',), '{out} = {0} or NULL'),
+                DOH_DBA_NAME:              (('DBA',), '{out} = {0}.replace(DBA_JUNK_CHAR, "") if {0}.strip() else NULL'),
+                DOH_ADDRESS_NAME:          (('BUILDING', 'STREET'), '{out} = WHITESPACE_RE.sub(" ", {0} + " " + {1}).strip()'),
+                DOH_ZIPCODE_NAME:          (('ZIPCODE',), '{out} = {0}.strip()\n{out} = {out} if ZIPCODE_RE.match({out}) else NULL'),
+                DOH_PHONE_NAME:            (('PHONE',), '{out} = PHONE_PUNCTUATION_RE.sub("", {0}) if PHONE_RE.match({0}) else NULL'),
+                DOH_INSPECTION_TYPE_NAME:  (('INSPECTION TYPE',), '{out} = {0} or NULL'),
+                DOH_INSPECTION_DATE_NAME:  (('INSPECTION DATE',), '{out} = {0} if {0} != NULL_INSPECTION_DATE else NULL'),
+                DOH_ACTION_NAME:           (('ACTION',), '{out} = ACTION_MAP.get({0}, {0}) if {0} else NULL'),
+                DOH_SCORE_NAME:            (('SCORE',), '{out} = {0} or NULL'),
+                DOH_GRADE_NAME:            (('GRADE',), '{out} = {0}.strip()\n{out} = {out} if GRADE_RE.match({out}) else NULL'),
+                DOH_GRADE_DATE_NAME:       (('GRADE DATE',), '{out} = {0} or NULL'),
+                DOH_VIOLATION_CODE_NAME:   (('VIOLATION CODE',), '{out} = {0} or NULL'),
+                DOH_CRITICAL_FLAG_NAME:    (('CRITICAL FLAG',), '{out} = (1 if {0} == "Critical" else 0) if {0} else NULL'),
+                DOH_RECORD_DATE_NAME:      (('RECORD DATE',), '{out} = {0} or NULL'),
+                }
+
+    def __init__(self, interned_fields = INTERNED_FIELDS):
+
+        self.interned_fields = interned_fields
+
+    def compile(self, header):
+
+        source = self._build_source(header)
+        namespace = {   
+                        '_intern': {}.setdefault,
+                        'NULL': NULL,
+                        'DBA_JUNK_CHAR': DBA_JUNK_CHAR,
+                        'NULL_INSPECTION_DATE': NULL_INSPECTION_DATE,
+                        'ZIPCODE_RE': ZIPCODE_RE,
+                        'PHONE_RE': PHONE_RE,
+                        'PHONE_PUNCTUATION_RE': PHONE_PUNCTUATION_RE,
+                        'GRADE_RE': GRADE_RE,
+                        'WHITESPACE_RE': WHITESPACE_RE,
+                        'ACTION_MAP': FieldCleaners.ACTION_MAP,
+                        '_new': tuple.__new__,
+                        '_Extract': DohInspectionExtract,
+                    }
+        exec source in namespace
+        return namespace['clean_row']
+
+    def _build_source(self, header):
+
+        index = dict((column, i) for i, column in enumerate(header))
+        
+        # bind every raw column used once; columns missing from the header 
+        # read as None, just as record.get does in FieldCleaners.
+        column_names = {}
+        lines = ['def clean_row(row):']
+        for doh_field in DOH_FIELDS:
+            for column in self.FIELD_TEMPLATES[doh_field][0]:
+                if column not in column_names:
+                    name = 'c{0}'.format(len(column_names))
+                    column_names[column] = name
+                    value = 'row[{0}]'.format(index[column]) if column in index else 'None'
+                    lines.append('    {0} = {1}'.format(name, value))
+
+        outs = []
+        for i, doh_field in enumerate(DOH_FIELDS):
+            columns, template = self.FIELD_TEMPLATES[doh_field]
+            out = 'f{0}'.format(i)
+            statement = template.format(*[column_names[c] for c in columns], out = out)
+            lines.extend('    ' + l for l in statement.split('\n'))
+            if doh_field in self.interned_fields:
+                # hand back the first copy of each value seen, so repeats share one string.
+                lines.append('    {out} = _intern({out}, {out})'.format(out = out))
+            outs.append(out)
+
+        lines.append('    return _new(_Extract, ({0},))'.format(', '.join(outs)))
+        return '\n'.join(lines) + '\n'
+
+
+
+
+class ColumnarExtracts(object):
+    '''Read-only sequence of DohInspectionExtracts backed by dictionary encoded 
+    columns: one list of distinct values and one integer code array per field.'''
+
+    def __init__(self, dictionaries, codes):
+
+        self.dictionaries = dictionaries
+        self.codes = codes
+
+    def __len__(self):
+
+        return len(self.codes[0])
+
+    def __getitem__(self, i):
+
+        return DohInspectionExtract._make(dictionary[codes[i]] for dictionary, codes in zip(self.dictionaries, self.codes))
+
+    def __iter__(self):
+
+        # decode a block of rows per column at a time, rather than per cell.
+        for start in xrange(0, len(self), CACHE_DECODE_BLOCK_SIZE):
+            end = start + CACHE_DECODE_BLOCK_SIZE
+            columns = [ [dictionary[code] for code in codes[start:end].tolist()] 
+                        for dictionary, codes in zip(self.dictionaries, self.codes) ]
+            for values in itertools.izip(*columns):
+                yield DohInspectionExtract._make(values)
+
+
+
+class CleanedInspectionCache(object):
+    '''Columnar on-disk cache of cleaned inspection data, keyed by the raw csv 
+    it was cleaned from and by CLEANER_VERSION and DOH_FIELDS, so a change to 
+    the cleaning invalidates it (as does clear()). 
+
+    The raw csv is identified by the ETag / Last-Modified it was downloaded 
+    with plus its size, read from the retriever's .meta file; only a csv 
+    without one is hashed in full.
+
+    File layout: CACHE_MAGIC, the length of the pickled header, the pickled 
+    header (raw key, cleaner version, fields, row count, per field dictionary 
+    and code dtype), then the code arrays, each 8 byte aligned. Loading 
+    unpickles the small header and maps the code arrays straight out of the 
+    mmapped file.'''
+
+    def __init__(self, cache_path = CLEAN_INSPECTION_CACHE_PATH):
+
+        self.cache_path = cache_path
+
+    def raw_key(self, read_path):
+
+        validators = InspectionDataRetriever().validators(read_path)
+        validator = validators.get('etag') or validators.get('last_modified')
+        if validator:
+            return '{0}:{1}'.format(validator, os.path.getsize(read_path))
+
+        md5 = hashlib.md5()
+        with open(read_path, 'rb') as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), ''):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def clear(self):
+
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def load(self, read_path, raw_key = None):
+        '''Return a ColumnarExtracts if the cache was built from read_path as it is 
+        now, by this version of the cleaner, otherwise None.'''
+
+        if not os.path.exists(self.cache_path):
+            return None
+
+        raw_key = raw_key or self.raw_key(read_path)
+
+        with open(self.cache_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if mm[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            return None
+
+        header_start = len(CACHE_MAGIC) + 8
+        header_len, = struct.unpack('<Q', mm[len(CACHE_MAGIC):header_start])
+        header = pickle.loads(mm[header_start:header_start + header_len])
+
+        if (header.get('raw_key'), header.get('cleaner_version'), header.get('fields')) != \
+                (raw_key, CLEANER_VERSION, DOH_FIELDS):
+            return None
+
+        offset = self._aligned(header_start + header_len)
+        codes = []
+        for dtype in header['dtypes']:
+            codes.append(np.frombuffer(mm, dtype = dtype, count = header['n_rows'], offset = offset))
+            offset = self._aligned(offset + header['n_rows'] * np.dtype(dtype).itemsize)
+
+        return ColumnarExtracts(header['dictionaries'], codes)
+
+    def write_through(self, read_path, extracts, raw_key = None):
+        '''Yield extracts unchanged while dictionary encoding them, and write the 
+        cache once they have all been consumed.'''
+
+        raw_key = raw_key or self.raw_key(read_path)
+
+        lookups = [{} for _ in DOH_FIELDS]
+        dictionaries = [[] for _ in DOH_FIELDS]
+        codes = [array.array('I') for _ in DOH_FIELDS]
+
+        for extract in extracts:
+            for value, lookup, dictionary, column_codes in zip(extract, lookups, dictionaries, codes):
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(dictionary)
+                    dictionary.append(value)
+                column_codes.append(code)
+            yield extract
+
+        self._write(raw_key, dictionaries, codes)
+
+    def _write(self, raw_key, dictionaries, codes):
+
+        dtypes = [self._code_dtype(len(dictionary)) for dictionary in dictionaries]
+        header = pickle.dumps({ 'raw_key': raw_key, 
+                                'cleaner_version': CLEANER_VERSION,
+                                'fields': DOH_FIELDS,
+                                'n_rows': len(codes[0]), 
+                                'dictionaries': dictionaries,
+                                'dtypes': dtypes,
+                                }, pickle.HIGHEST_PROTOCOL)
+
+        tmp_path = self.cache_path + PART_FILE_SUFFIX
+        with open(tmp_path, 'wb') as f:
+
+            f.write(CACHE_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+
+            for dtype, column_codes in zip(dtypes, codes):
+                f.write('\0' * (self._aligned(f.tell()) - f.tell()))
+                np.frombuffer(column_codes, dtype = np.uint32).astype(dtype).tofile(f)
+
+        os.rename(tmp_path, self.cache_path)
+
+    def _code_dtype(self, n_values):
+
+        for dtype in ('uint8', 'uint16', 'uint32'):
+            if n_values <= np.iinfo(dtype).max + 1:
+                return dtype
+
+    def _aligned(self, offset):
+
+        return (offset + 7) & ~7
+
+
+
+class RestaurantAggregator(object):
+    '''Passes DohInspectionExtracts through unchanged (consume) while building 
+    one DohRestaurantSummary per doh_camis: the restaurant fields of its first 
+    row, the number of distinct inspections (date, type) and its latest grade.'''
 
     def __init__(self):
 
+        self.restaurants = OrderedDict()
+
+    def consume(self, extracts):
+
+        restaurants = self.restaurants
+        for extract in extracts:
+
+            state = restaurants.get(extract.doh_camis)
+            if state is None:
+                # [first extract, inspection keys, latest grade key, latest grade, latest grade date]
+                state = restaurants[extract.doh_camis] = [extract, set(), None, NULL, NULL]
+
+            state[1].add((extract.doh_inspection_date, extract.doh_inspection_type))
+
+            if extract.doh_grade is not NULL:
+                grade_date = extract.doh_grade_date or extract.doh_inspection_date
+                key = self._date_key(grade_date)
+                if state[2] is None or key > state[2]:
+                    state[2:] = [key, extract.doh_grade, grade_date]
+
+            yield extract
+
+    def summaries(self):
+
+        for first, inspection_keys, _, latest_grade, latest_grade_date in self.restaurants.itervalues():
+            yield DohRestaurantSummary( doh_camis = first.doh_camis,
+                                        doh_dba = first.doh_dba,
+                                        doh_address = first.doh_address,
+                                        doh_zipcode = first.doh_zipcode,
+                                        doh_phone = first.doh_phone,
+                                        doh_inspection_count = len(inspection_keys),
+                                        doh_latest_grade = latest_grade,
+                                        doh_latest_grade_date = latest_grade_date)
+
+    def _date_key(self, date):
+        '''MM/DD/YYYY -> (YYYY, MM, DD) so dates compare chronologically.'''
+
+        if not date:
+            return ('', '', '')
+        return (date[6:10], date[0:2], date[3:5])
+
+
+
+def _clean_rows(reader, header, compiled, interned_fields):
+
+    if compiled:
+        clean_row = CompiledRecordCleaner(interned_fields).compile(header)
+        for row in reader:
+            yield clean_row(row)
+        return
+
+    for row in reader:
+        record_dict =  dict(zip(header, row))
+        yield InspectionRecordCleaner.clean(record_dict)
+
+
+def _clean_shard(shard):
+    '''Process pool worker: clean the rows in the byte range [start, end) 
+    of the csv. Defined at module level so it can be pickled.'''
+
+    read_path, fmtparams, header, start, end, compiled, interned_fields = shard
+
+    with open(read_path, 'rb') as f:
+        f.seek(start)
+        lines = StringIO(f.read(end - start))
+
+    # plain tuples pickle and unpickle much faster than namedtuples.
+    reader = csv.reader(lines, **fmtparams)
+    return [tuple(record) for record in _clean_rows(reader, header, compiled, interned_fields)]
+
+
+class InspectionDataCleaner:
+
+    def __init__(self, compiled = True, n_workers = 1, shards_per_worker = 4, cache_path = None, 
+                    intern_strings = True):
+
         self.record_cleaner = InspectionRecordCleaner()
+        self.compiled = compiled
+        self.interned_fields = INTERNED_FIELDS if intern_strings else ()
+        self.n_workers = n_workers
+        self.shards_per_worker = shards_per_worker
+        self.max_in_flight = 2 * n_workers
+        self.cache = CleanedInspectionCache(cache_path) if cache_path else None
 
     def clean(self, read_path):
 
+        return list(self.clean_iter(read_path))
+
+    def clean_iter(self, read_path):
+        '''Lazily yield cleaned DohInspectionExtracts one csv row at a time, 
+        so memory stays flat no matter how large the export is. With n_workers > 1 
+        the csv is cut into newline aligned byte ranges which are cleaned in a 
+        process pool; records still come out in file order. 
+        Given a cache_path (e.g. CLEAN_INSPECTION_CACHE_PATH), a columnar cache 
+        built from this exact csv by this cleaner is read instead, otherwise it 
+        is rebuilt as the records stream past.'''
+
+        if self.cache is None:
+            return self._clean_iter_uncached(read_path)
+
+        raw_key = self.cache.raw_key(read_path)
+        cached_extracts = self.cache.load(read_path, raw_key)
+        if cached_extracts is not None:
+            return iter(cached_extracts)
+
+        return self.cache.write_through(read_path, self._clean_iter_uncached(read_path), raw_key)
+
+    def _clean_iter_uncached(self, read_path):
+
+        if self.n_workers > 1:
+            return self._clean_iter_parallel(read_path)
+
+        return self._clean_iter_serial(read_path)
+
+    def _clean_iter_serial(self, read_path):
+
         with open(read_path, 'rt') as f:
             
-            dialect = csv.Sniffer().sniff(f.read(1024))
-            f.seek(0)
-            reader = csv.reader(f, dialect)
+            fmtparams = self._sniff_fmtparams(f)
+            reader = csv.reader(f, **fmtparams)
             header = reader.next()
-            
-            records = []
-            for row in reader:
-                record_dict =  dict(zip(header, row))
-                cleaned_record = self.record_cleaner.clean(record_dict)
-                records.append(cleaned_record)
-
-        return records                
 
+            for record in _clean_rows(reader, header, self.compiled, self.interned_fields):
+                yield record
+
+    def _clean_iter_parallel(self, read_path):
+
+        with open(read_path, 'rb') as f:
+
+            fmtparams = self._sniff_fmtparams(f)
+            # the header never contains embedded newlines, so a plain readline 
+            # gives both the header and the byte offset the data starts at.
+            header = csv.reader([f.readline()], **fmtparams).next()
+            data_start = f.tell()
+
+        n_shards = max(self.n_workers * self.shards_per_worker, 
+                        -(-(os.path.getsize(read_path) - data_start) // SHARD_MAX_BYTES))
+        offsets = self._shard_offsets(read_path, data_start, n_shards, 
+                                        csv.get_dialect(fmtparams['dialect']).quotechar)
+        shards = iter([ (read_path, fmtparams, header, start, end, self.compiled, self.interned_fields) 
+                        for start, end in zip(offsets[:-1], offsets[1:]) ])
+
+        pool = multiprocessing.Pool(self.n_workers)
+        try:
+            # at most max_in_flight shards are being cleaned or waiting to be 
+            # consumed (imap would queue every finished shard); they are handed 
+            # back in file order, and each one consumed lets the next one start.
+            in_flight = deque()
+            for shard in itertools.islice(shards, self.max_in_flight):
+                in_flight.append(pool.apply_async(_clean_shard, (shard,)))
+
+            while in_flight:
+                records = in_flight.popleft().get()
+                for shard in itertools.islice(shards, 1):
+                    in_flight.append(pool.apply_async(_clean_shard, (shard,)))
+
+                for record in records:
+                    yield tuple.__new__(DohInspectionExtract, record)
+                del records
+        finally:
+            pool.terminate()
+
+    def _sniff_fmtparams(self, f):
+        '''Only the delimiter is sniffed, from the header line; quoting follows 
+        the standard excel dialect the export is written in.'''
+
+        delimiter = csv.Sniffer().sniff(f.readline(), SNIFF_DELIMITERS).delimiter
+        f.seek(0)
+        return {'dialect': 'excel', 'delimiter': delimiter}
+
+    def _shard_offsets(self, read_path, data_start, n_shards, quotechar):
+        '''Byte offsets that split the data into roughly n_shards ranges, each 
+        starting on a row boundary. A newline only ends a row when an even number 
+        of quote characters precedes it, so quoted fields with embedded 
+        newlines are never split.'''
+
+        size = os.path.getsize(read_path)
+        targets = [data_start + (size - data_start) * i // n_shards for i in range(1, n_shards)]
+
+        offsets = [data_start]
+        with open(read_path, 'rb') as f:
+
+            f.seek(data_start)
+            pos, in_quotes = data_start, False
+
+            for target in targets:
+
+                if target <= pos:
+                    continue
+
+                # count quotes in bulk up to the target.
+                while pos < target:
+                    block = f.read(min(SHARD_SCAN_BLOCK_SIZE, target - pos))
+                    in_quotes ^= bool(block.count(quotechar) % 2)
+                    pos += len(block)
+
+                # then walk forward to the first newline outside a quoted field.
+                boundary = None
+                while boundary is None:
+                    block = f.read(SHARD_SCAN_BLOCK_SIZE)
+                    if not block:
+                        break
+                    for i, char in enumerate(block):
+                        if char == quotechar:
+                            in_quotes = not in_quotes
+                        elif char == '\n' and not in_quotes:
+                            boundary = pos + i + 1
+                            break
+                    if boundary is None:
+                        pos += len(block)
+
+                if boundary is None or boundary >= size:
+                    break
+
+                offsets.append(boundary)
+                pos = boundary
+                f.seek(pos)
+
+        offsets.append(size)
+        return offsets
 
 
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import random
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+
+SEARCH_PATH = '/v2/search'
+PHONE_SEARCH_PATH = '/v2/phone_search'
+
+CATEGORIES = [['Pizza', 'pizza'], ['Delis', 'delis'], ['Chinese', 'chinese'], ['Coffee & Tea', 'coffee'],
+                ['Bakeries', 'bakeries'], ['Bars', 'bars'], ['Mexican', 'mexican'], ['Sushi Bars', 'sushi']]
+
+NEIGHBORHOODS = ['Midtown West', 'Hell\'s Kitchen', 'Williamsburg', 'Astoria', 'Flatiron', 'SoHo']
+
+
+def synthetic_business(rng, name = None, phone = None, zipcode = None):
+    '''A business dict shaped like the v2 api's, including the fields the
+    response parser skips.'''
+
+    business_id = '{0}-{1}'.format((name or 'restaurant').lower().replace(' ', '-'), rng.randint(0, 10**6))
+    phone = phone or '1212555{0:04d}'.format(rng.randint(0, 9999))
+
+    return {'id': business_id,
+            'name': name or 'Restaurant {0}'.format(rng.randint(0, 10**6)),
+            'phone': '+' + phone if len(phone) == 11 else '+1' + phone,
+            'display_phone': '+1-212-555-0000',
+            'review_count': rng.randint(0, 2000),
+            'rating': rng.choice([1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5]),
+            'rating_img_url': 'http://s3-media1.fl.yelpassets.com/assets/2/www/img/stars_4.png',
+            'snippet_text': 'Great food, friendly staff. ' * rng.randint(1, 5),
+            'url': 'http://www.yelp.com/biz/{0}'.format(business_id),
+            'is_closed': False,
+            'categories': rng.sample(CATEGORIES, rng.randint(1, 3)),
+            'location': {
+                'address': ['{0} Broadway'.format(rng.randint(1, 2500))],
+                'display_address': ['1 Broadway', 'New York, NY 10004'],
+                'city': 'New York',
+                'postal_code': zipcode or str(rng.randint(10001, 11697)),
+                'state_code': 'NY',
+                'country_code': 'US',
+                'neighborhoods': rng.sample(NEIGHBORHOODS, rng.randint(0, 2)),
+                'coordinate': {'latitude': 40.7, 'longitude': -74.0},
+                },
+            }
+
+
+def search_response(businesses):
+
+    return {'total': len(businesses),
+            'businesses': businesses,
+            'region': {'center': {'latitude': 40.7, 'longitude': -74.0}}}
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class MockYelpApiServer(object):
+    '''Local stand-in for the v2 search and phone_search endpoints, so the api
+    interfacers can be load tested without spending quota. Each request waits
+    around latency seconds, then fails with a 429 (and a Retry-After of
+    retry_after seconds) with probability throttle_rate, or a 500/503 with
+    probability error_rate. Otherwise it returns synthetic businesses: the
+    number's restaurant (sometimes none, sometimes two) for a phone search,
+    up to limit restaurants named like the term for a search.
+
+    Counts the responses it sent by status code.'''
+
+    def __init__(self, latency = .05, error_rate = 0., throttle_rate = 0., retry_after = 1, seed = 0):
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.status_counts = {}
+
+    def __enter__(self):
+
+        mock = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                url = urlparse.urlparse(self.path)
+                params = dict(urlparse.parse_qsl(url.query))
+                status, headers, body = mock.respond(url.path, params)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for header in headers.iteritems():
+                    self.send_header(*header)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def url(self, path):
+
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_address[1], path)
+
+    def __exit__(self, type, value, traceback):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, params):
+
+        with self.lock:
+            # the handler threads share self.rng; each request gets its own.
+            rng = random.Random(self.rng.random())
+            outcome = self.rng.random()
+
+        time.sleep(self.latency * rng.uniform(.5, 1.5))
+
+        if outcome < self.throttle_rate:
+            return self._count(429, {'Retry-After': str(self.retry_after)},
+                                {'error': {'id': 'EXCEEDED_REQS', 'text': 'Exceeded max requests'}})
+
+        if outcome < self.throttle_rate + self.error_rate:
+            return self._count(rng.choice([500, 503]), {},
+                                {'error': {'id': 'INTERNAL_ERROR', 'text': 'Mock failure'}})
+
+        if path == PHONE_SEARCH_PATH:
+            n_businesses = rng.choice([0, 1, 1, 1, 1, 1, 1, 1, 2])
+            businesses = [synthetic_business(rng, phone = params.get('phone')) for _ in range(n_businesses)]
+
+        elif path == SEARCH_PATH:
+            n_businesses = rng.randint(0, int(params.get('limit', 20)))
+            businesses = [synthetic_business(rng, name = params.get('term')) for _ in range(n_businesses)]
+
+        else:
+            return self._count(404, {}, {'error': {'id': 'NOT_FOUND', 'text': path}})
+
+        return self._count(200, {}, search_response(businesses))
+
+    def _count(self, status, headers, response_json):
+
+        with self.lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+        return status, headers, json.dumps(response_json)
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--latency', help = 'Mean response latency in seconds.', required = False)
+    parser.add_argument('-e', '--error_rate', help = 'Fraction of requests answered with a 500 or 503.', required = False)
+    parser.add_argument('-t', '--throttle_rate', help = 'Fraction of requests answered with a 429.', required = False)
+
+    parser.set_defaults(latency = .05, error_rate = 0., throttle_rate = 0.)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    with MockYelpApiServer(latency = float(args.latency), error_rate = float(args.error_rate),
+                            throttle_rate = float(args.throttle_rate)) as server:
+
+        print "Serving {0} and {1}; ctrl-c to stop.".format(server.url(SEARCH_PATH), server.url(PHONE_SEARCH_PATH))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
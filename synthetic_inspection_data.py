@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import random
+
+
+DOH_CSV_HEADER = [  'CAMIS',
+                    'DBA',
+                    'BORO',
+                    'BUILDING',
+                    'STREET',
+                    'ZIPCODE',
+                    'PHONE',
+                    'CUISINE DESCRIPTION',
+                    'INSPECTION DATE',
+                    'ACTION',
+                    'VIOLATION CODE',
+                    'VIOLATION DESCRIPTION',
+                    'CRITICAL FLAG',
+                    'SCORE',
+                    'GRADE',
+                    'GRADE DATE',
+                    'RECORD DATE',
+                    'INSPECTION TYPE',
+                 ]
+
+BOROS = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+
+NAME_WORDS = ['GOLDEN', 'DRAGON', 'PIZZA', 'CAFE', 'DELI', 'BAGEL', 'SUSHI', 'GRILL', 'TACO',
+                'KITCHEN', 'BAR', 'HOUSE', 'EXPRESS', 'FAMOUS', 'RAY\'S', 'JOE\'S', 'NEW', 'YORK',
+                'HALAL', 'CHICKEN', 'BURGER', 'NOODLE', 'GARDEN', 'PALACE', 'BAKERY', 'COFFEE']
+
+STREETS = ['BROADWAY', 'WEST   45 STREET', 'EAST 14 ST', 'AVENUE OF THE AMERICAS', 'LEXINGTON AVENUE',
+            'FLATBUSH AVE', 'QUEENS BOULEVARD', 'GRAND CONCOURSE', 'BEDFORD AVENUE', '8 AVENUE']
+
+CUISINES = ['American', 'Chinese', 'Pizza', 'Italian', 'Café/Coffee/Tea', 'Mexican', 'Japanese',
+            'Latin (Cuban, Dominican, Puerto Rican, South & Central American)', 'Bakery', 'Caribbean']
+
+ACTIONS = [ 'Violations were cited in the following area(s).',
+            'No violations were recorded at the time of this inspection.',
+            'Establishment Closed by DOHMH.  Violations were cited in the following area(s) and those requiring immediate action were addressed.',
+            'Establishment re-opened by DOHMH',
+            '',
+          ]
+
+VIOLATIONS = [  ('04L', 'Evidence of mice or live mice present in facility\'s food and/or non-food areas.', 'Critical'),
+                ('06D', 'Food contact surface not properly washed, rinsed and sanitized after each use.', 'Critical'),
+                ('08A', 'Facility not vermin proof. Harborage or conditions conducive to attracting vermin.', 'Not Critical'),
+                ('10F', 'Non-food contact surface improperly constructed. Unacceptable material used.', 'Not Critical'),
+                ('02G', 'Cold food item held above 41º F (smoked fish and reduced oxygen packaged foods above 38 ºF).', 'Critical'),
+                ('10B', 'Plumbing not properly installed or maintained; "anti-siphonage" device missing,\nsewage disposal system in disrepair.', 'Not Critical'),
+                ('', '', 'Not Applicable'),
+             ]
+
+INSPECTION_TYPES = ['Cycle Inspection / Initial Inspection', 'Cycle Inspection / Re-inspection',
+                    'Pre-permit (Operational) / Initial Inspection', 'Administrative Miscellaneous / Initial Inspection']
+
+GRADES = ['A', 'A', 'A', 'B', 'C', 'Z', 'P', 'Not Yet Graded', '']
+
+
+class SyntheticInspectionDataGenerator(object):
+    '''Deterministically generates csvs in the layout of the NYC DOH inspection
+    export, dirty values included: 01/01/1900 inspection dates, 'Â' in DBA names,
+    malformed zipcodes and phone numbers, runs of whitespace in street names and
+    quoted fields with embedded commas and newlines. The same seed always
+    produces the same file.'''
+
+    def __init__(self, seed = 0, rows_per_restaurant = 12, violations_per_inspection = 3):
+
+        self.seed = seed
+        self.rows_per_restaurant = rows_per_restaurant
+        self.violations_per_inspection = violations_per_inspection
+
+    def write(self, write_path, n_rows):
+
+        with open(write_path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(DOH_CSV_HEADER)
+            for row in self.rows(n_rows):
+                writer.writerow(row)
+
+    def rows(self, n_rows):
+
+        rng = random.Random(self.seed)
+        n_written = 0
+        camis = 30000000
+
+        while n_written < n_rows:
+
+            camis += rng.randint(1, 50)
+            restaurant = self._restaurant(rng, camis)
+
+            while n_written < n_rows:
+
+                inspection = self._inspection(rng)
+                for _ in range(rng.randint(1, self.violations_per_inspection)):
+                    yield restaurant + self._violation_row(rng, inspection)
+                    n_written += 1
+                    if n_written >= n_rows:
+                        return
+
+                if rng.random() < 1.0 / (self.rows_per_restaurant / float(self.violations_per_inspection)):
+                    break
+
+    def _restaurant(self, rng, camis):
+
+        dba = ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 3)))
+        if rng.random() < .05:
+            dba = dba.replace('E', 'Â', 1)
+        if rng.random() < .02:
+            dba = '  '
+
+        zipcode = str(rng.randint(10001, 11697))
+        if rng.random() < .02:
+            zipcode = rng.choice(['N/A', '1000', ''])
+
+        phone = '{0}{1:03d}{2:04d}'.format(rng.choice(['212', '718', '347', '646']), rng.randint(200, 999), rng.randint(0, 9999))
+        if rng.random() < .03:
+            phone = rng.choice(['__________', '', '+1 ' + phone])
+
+        return [str(camis),
+                dba,
+                rng.choice(BOROS),
+                str(rng.randint(1, 2500)),
+                rng.choice(STREETS),
+                zipcode,
+                phone,
+                rng.choice(CUISINES)]
+
+    def _inspection(self, rng):
+
+        if rng.random() < .03:
+            inspection_date = '01/01/1900'
+        else:
+            inspection_date = '{0:02d}/{1:02d}/{2}'.format(rng.randint(1, 12), rng.randint(1, 28), rng.randint(2011, 2015))
+
+        grade = rng.choice(GRADES)
+        grade_date = inspection_date if grade and inspection_date != '01/01/1900' else ''
+
+        return (inspection_date,
+                rng.choice(ACTIONS),
+                str(rng.randint(0, 60)) if rng.random() > .05 else '',
+                grade,
+                grade_date,
+                rng.choice(INSPECTION_TYPES))
+
+    def _violation_row(self, rng, inspection):
+
+        inspection_date, action, score, grade, grade_date, inspection_type = inspection
+        violation_code, violation_description, critical_flag = rng.choice(VIOLATIONS)
+
+        return [inspection_date,
+                action,
+                violation_code,
+                violation_description,
+                critical_flag,
+                score,
+                grade,
+                grade_date,
+                '10/18/2015',
+                inspection_type]
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_rows', help = 'Number of inspection rows to generate.', required = True)
+    parser.add_argument('-p', '--path', help = 'Where to write the csv.', required = True)
+    parser.add_argument('-s', '--seed', help = 'Random seed.', required = False)
+
+    parser.set_defaults(seed = 0)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    SyntheticInspectionDataGenerator(seed = int(args.seed)).write(args.path, int(args.n_rows))
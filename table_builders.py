@@ -1,30 +1,40 @@
 # -*- coding: utf-8 -*-
 
 import psycopg2
+import psycopg2.extras
 from operator import itemgetter
 import itertools
+import hashlib
 from psycopg2.extras import NamedTupleConnection
 from yelp_api_machinery import RestaurantYelpExtract
-from inspection_data_machinery import DohInspectionExtract
-from constants import   DB_NAME, 
-                        DOH_RESTAURANTS_TABLE_NAME, 
+from inspection_data_machinery import DohInspectionExtract, RestaurantAggregator
+from constants import   DB_NAME, \
+                        DOH_RESTAURANTS_TABLE_NAME, \
                         DOH_INSPECTIONS_TABLE_NAME, \
-                        YELP_RESTAURANTS_TABLE_NAME, 
+                        YELP_RESTAURANTS_TABLE_NAME, \
                         YELP_CATEGORIES_TABLE_NAME, \
-                        YELP_REVIEWS_TABLE_NAME, 
-                        YELP_NEIGHBORHOODS_TABLE_NAME
+                        YELP_REVIEWS_TABLE_NAME, \
+                        YELP_NEIGHBORHOODS_TABLE_NAME, \
+                        YELP_PULL_PROGRESS_TABLE_NAME, \
+                        INSERT_BATCH_SIZE
+
+
+EXECUTEMANY_LOAD = 'executemany'
+VALUES_LOAD = 'values'
+COPY_LOAD = 'copy'
 
 
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
 
-def DBConnectionManager(object):
+class DBConnContextManager(object):
 
     def __enter__(self):
 
         self.conn = psycopg2.connect( "dbname={db_name}".format(db_name = DB_NAME), 
                                         cursor_factory=psycopg2.extras.NamedTupleCursor)
+        return self
 
     def __exit__(self, type, value, traceback):
         self.conn.__exit__(type, value, traceback)
@@ -32,9 +42,63 @@ def DBConnectionManager(object):
 
 
 
+class CopyStream(object):
+    '''File-like object for cursor.copy_expert that renders formatted extracts 
+    (dicts) into COPY text format lazily, as postgres asks for more data.'''
+
+    ESCAPES = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]
+
+    def __init__(self, formatted_extracts, columns):
+
+        self.formatted_extracts = iter(formatted_extracts)
+        self.columns = columns
+        self.buffer = ''
+
+    def read(self, size = -1):
+
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += self._format_line(self.formatted_extracts.next())
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self.buffer)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size = -1):
+
+        return self.read(size)
+
+    def _format_line(self, d):
+
+        return '\t'.join(self._format_value(d.get(column)) for column in self.columns) + '\n'
+
+    def _format_value(self, value):
+
+        if value is None:
+            return '\\N'
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            value = str(value)
+
+        for char, escaped in self.ESCAPES:
+            if char in value:
+                value = value.replace(char, escaped)
+
+        return value
+
+
+
 class TableBuilder(object):
     '''Baseclases for the classes which build database tables 
     from ______Extract named tuples.'''
+
+    load_method = EXECUTEMANY_LOAD
     
     # def _open_conn(self):
         
@@ -69,15 +133,65 @@ class TableBuilder(object):
                 c.execute(self.create_table_q)
 
     
-    def add_records(self, extracts):
-        
+    def add_records(self, extracts, batch_size = INSERT_BATCH_SIZE, load_method = None):
+        '''extracts may be any iterable (e.g. InspectionDataCleaner.clean_iter), 
+        it is consumed batch_size formatted records at a time. load_method is one 
+        of EXECUTEMANY_LOAD, VALUES_LOAD or COPY_LOAD and defaults to the 
+        builder's own load_method.'''
+
         with DBConnContextManager() as cm:
             with cm.conn.cursor() as c:
+                self.write_records(c, extracts, batch_size, load_method)
+
+    def write_records(self, c, extracts, batch_size = INSERT_BATCH_SIZE, load_method = None):
+        '''add_records on the caller's cursor c, so the rows commit (or roll 
+        back) with whatever else the caller writes in that transaction.'''
+
+        self._write_records(c, self._format_extracts(extracts), batch_size, load_method)
+
+    def _write_records(self, c, formatted_extracts, batch_size = INSERT_BATCH_SIZE, load_method = None):
+
+        load_method = load_method or self.load_method
+
+        if load_method == COPY_LOAD:
+            self._copy_records(c, formatted_extracts)
+
+        elif load_method == VALUES_LOAD:
+            self._insert_values(c, formatted_extracts, batch_size)
+
+        else:
+            q = self.insert_records_q_template
+            for batch in self._batches(formatted_extracts, batch_size):
+                c.executemany(q, batch)
 
-                q = self.insert_records_q_template
-                formatted_extracts = self.format_extracts(extracts)
-                c.executemany(q, formatted_extracts)
+    def _copy_records(self, c, formatted_extracts):
+        '''Stream the records into the table with a single COPY ... FROM STDIN 
+        in postgres' text format.'''
+
+        q = "COPY {table_name} ({columns}) FROM STDIN".format(  table_name = self.table_name,
+                                                                columns = ', '.join(self.columns))
+        c.copy_expert(q, CopyStream(formatted_extracts, self.columns))
+
+    def _insert_values(self, c, formatted_extracts, batch_size):
+        '''One multi-row INSERT ... VALUES per batch, for servers (or poolers) 
+        where COPY is not available.'''
+
+        q = "INSERT INTO {table_name} ({columns}) VALUES %s".format(table_name = self.table_name,
+                                                                    columns = ', '.join(self.columns))
+        template = '({0})'.format(', '.join('%({0})s'.format(column) for column in self.columns))
+
+        for batch in self._batches(formatted_extracts, batch_size):
+            psycopg2.extras.execute_values(c, q, batch, template = template, page_size = batch_size)
         
+    def _batches(self, formatted_extracts, batch_size):
+
+        formatted_extracts = iter(formatted_extracts)
+        while True:
+            batch = list(itertools.islice(formatted_extracts, batch_size))
+            if not batch:
+                return
+            yield batch
+
     def _format_extract(self, extract):  
         
         d = extract._asdict()
@@ -86,7 +200,7 @@ class TableBuilder(object):
     
     def _format_extracts(self, extracts):
 
-        return map(self._format_extract, extracts)
+        return itertools.imap(self._format_extract, extracts)
 
     # def _create_table(self, conn):
     #     raise NotImplementedError
@@ -103,7 +217,7 @@ class NestedExtractTableBuilder(TableBuilder):
 
     def _format_extracts(self, extracts):
 
-        return itertools.chain(*map(self._format_extract, extracts))  
+        return itertools.chain.from_iterable(itertools.imap(self._format_extract, extracts))  
 
 
 # abstract out repeated execute many logic in _add_record andd create_table:
@@ -114,6 +228,74 @@ class NestedExtractTableBuilder(TableBuilder):
 # DohTableBuilder
 
 
+class DOHTableBuilder(TableBuilder):
+    '''Baseclass for the tables built from DohInspectionExtract named tuples. 
+    These are the big tables, so they bulk load with COPY by default.
+
+    Every row carries a doh_fingerprint (md5 of its fields), which lets 
+    add_delta_records load a fresh export without DROP ... CASCADE: rows whose 
+    fingerprint is already in the table are skipped and only new or changed 
+    rows are written, so the yelp_* tables referencing doh_restaurants survive. 
+    Tables created before doh_fingerprint existed need one full rebuild first.
+
+    The export is a full snapshot, so with delete_stale_rows a loaded row 
+    whose fingerprint is no longer in it (the old version of a changed row, 
+    or a removed one) is deleted in the same transaction.'''
+
+    load_method = COPY_LOAD
+    delete_stale_rows = False
+
+    def add_delta_records(self, extracts, batch_size = INSERT_BATCH_SIZE):
+
+        with DBConnContextManager() as cm:
+            with cm.conn.cursor() as c:
+
+                loaded_fingerprints = self._loaded_fingerprints(c)
+                changed_extracts = self._changed_extracts(self._format_extracts(extracts), loaded_fingerprints)
+
+                template = '({0})'.format(', '.join('%({0})s'.format(column) for column in self.columns))
+                
+                n_changed = 0
+                for batch in self._batches(changed_extracts, batch_size):
+                    psycopg2.extras.execute_values(c, self.delta_q_template, batch, template = template, page_size = batch_size)
+                    n_changed += len(batch)
+
+                # what _changed_extracts left are the fingerprints missing from the export.
+                n_stale = 0
+                if self.delete_stale_rows:
+                    for batch in self._batches(loaded_fingerprints, batch_size):
+                        c.execute("DELETE FROM {table_name} WHERE doh_fingerprint IN %s;".format(table_name = self.table_name), 
+                                    (tuple(batch),))
+                        n_stale += len(batch)
+
+        print "{0}: {1} new or changed rows written, {2} superseded or removed rows deleted.".format(
+                                        self.table_name, n_changed, n_stale)
+        return n_changed
+
+    def _loaded_fingerprints(self, c):
+
+        c.execute("SELECT doh_fingerprint FROM {table_name};".format(table_name = self.table_name))
+        return set(row[0] for row in c)
+
+    def _changed_extracts(self, formatted_extracts, loaded_fingerprints):
+        '''The formatted extracts whose fingerprint is not loaded. Fingerprints 
+        seen in the export are taken out of loaded_fingerprints as it goes.'''
+
+        for d in formatted_extracts:
+            try:
+                loaded_fingerprints.remove(d['doh_fingerprint'])
+            except KeyError:
+                yield d
+
+    def _fingerprint(self, d, extra = ''):
+
+        values = [d.get(column) for column in self.columns if column != 'doh_fingerprint']
+        values = [  '\\N' if value is None else 
+                    value.encode('utf-8') if isinstance(value, unicode) else str(value) 
+                    for value in values ]
+        return hashlib.md5('\x1f'.join(values) + extra).hexdigest()
+
+
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
@@ -121,6 +303,10 @@ class NestedExtractTableBuilder(TableBuilder):
 
 class DohRestaurantsTableBuilder(DOHTableBuilder):
 
+    table_name = DOH_RESTAURANTS_TABLE_NAME
+
+    columns = [ 'doh_camis', 'doh_dba', 'doh_address', 'doh_zipcode', 'doh_phone', 
+                'doh_inspection_count', 'doh_latest_grade', 'doh_latest_grade_date', 'doh_fingerprint']
 
     create_table_q = '''
                         CREATE TABLE {doh_restaurants_table_name} (
@@ -128,7 +314,11 @@ class DohRestaurantsTableBuilder(DOHTableBuilder):
                             doh_dba varchar(255),
                             doh_address varchar(100),
                             doh_zipcode varchar(5),
-                            doh_phone varchar(12)
+                            doh_phone varchar(12),
+                            doh_inspection_count smallint,
+                            doh_latest_grade varchar(1),
+                            doh_latest_grade_date date,
+                            doh_fingerprint char(32)
                         );
                         '''.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
 
@@ -136,16 +326,39 @@ class DohRestaurantsTableBuilder(DOHTableBuilder):
 
     insert_records_q_template = '''
                                 INSERT INTO {doh_restaurants_table_name} 
-                                    (doh_camis, doh_dba, doh_address, doh_zipcode, doh_phone)
+                                    (doh_camis, doh_dba, doh_address, doh_zipcode, doh_phone, 
+                                        doh_inspection_count, doh_latest_grade, doh_latest_grade_date, doh_fingerprint)
                                     VALUES (
                                         %(doh_camis)s,
                                         %(doh_dba)s,
                                         %(doh_address)s,
                                         %(doh_zipcode)s,
-                                        %(doh_phone)s
+                                        %(doh_phone)s,
+                                        %(doh_inspection_count)s,
+                                        %(doh_latest_grade)s,
+                                        %(doh_latest_grade_date)s,
+                                        %(doh_fingerprint)s
                                     );
                                 '''.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
 
+    # a changed restaurant is updated in place, so rows referencing it are kept; 
+    # one gone from the export is kept too (delete_stale_rows stays off).
+    delta_q_template = '''
+                        INSERT INTO {doh_restaurants_table_name} 
+                            (doh_camis, doh_dba, doh_address, doh_zipcode, doh_phone, 
+                                doh_inspection_count, doh_latest_grade, doh_latest_grade_date, doh_fingerprint)
+                            VALUES %s
+                        ON CONFLICT (doh_camis) DO UPDATE SET
+                            doh_dba = EXCLUDED.doh_dba,
+                            doh_address = EXCLUDED.doh_address,
+                            doh_zipcode = EXCLUDED.doh_zipcode,
+                            doh_phone = EXCLUDED.doh_phone,
+                            doh_inspection_count = EXCLUDED.doh_inspection_count,
+                            doh_latest_grade = EXCLUDED.doh_latest_grade,
+                            doh_latest_grade_date = EXCLUDED.doh_latest_grade_date,
+                            doh_fingerprint = EXCLUDED.doh_fingerprint;
+                        '''.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
+
     # def __init__(self):
 
     #     TableBuilder.__init__(self)
@@ -188,20 +401,28 @@ class DohRestaurantsTableBuilder(DOHTableBuilder):
     #         c.executemany(q_template, unique_restaurant_extracts)
 
     def _format_extracts(self, extracts):
+        '''Takes DohInspectionExtracts, one restaurant row per doh_camis.'''
 
-        seen = set() 
+        aggregator = RestaurantAggregator()
+        for _ in aggregator.consume(extracts):
+            pass
 
-        unique_restaurant_extracts = []            
-        for extract in inspection_extracts:
+        return self._format_summaries(aggregator.summaries())
 
-            d = self._format_extract(extract) 
+    def write_summaries(self, c, summaries, batch_size = INSERT_BATCH_SIZE, load_method = None):
+        '''write_records for DohRestaurantSummaries already aggregated by the caller.'''
 
-            if d.get('doh_camis') not in seen:
-            
-                unique_restaurant_extracts.append(d)
-                seen.add(d.get('doh_camis'))
+        self._write_records(c, self._format_summaries(summaries), batch_size, load_method)
+
+    def _format_summaries(self, summaries):
 
-        return unique_restaurant_extracts
+        return itertools.imap(self._format_extract, summaries)
+
+    def _format_extract(self, extract):
+
+        d = extract._asdict()
+        d['doh_fingerprint'] = self._fingerprint(d)
+        return d
 
 
 ####--------------------------------------------------------------------------------------------------------####
@@ -210,10 +431,14 @@ class DohRestaurantsTableBuilder(DOHTableBuilder):
 
 class DohInspectionsTableBuilder(DOHTableBuilder):
 
+        table_name = DOH_INSPECTIONS_TABLE_NAME
+
+        columns = [ 'doh_camis', 'doh_inspection_type', 'doh_inspection_date', 'doh_action', 'doh_score', 
+                    'doh_grade', 'doh_grade_date', 'doh_violation_code', 'doh_critical_flag', 'doh_fingerprint']
 
         create_table_q = '''
                             CREATE TABLE {doh_inspections_table_name} (
-                                doh_camis varchar(10) REFERENCES {doh_restaurants_table_name},
+                                doh_camis varchar(10) REFERENCES {doh_restaurants_table_name} DEFERRABLE,
                                 doh_inspection_type varchar(64),
                                 doh_inspection_date date,
                                 doh_action varchar(150),
@@ -221,7 +446,8 @@ class DohInspectionsTableBuilder(DOHTableBuilder):
                                 doh_grade varchar(1),
                                 doh_grade_date date,
                                 doh_violation_code varchar(3),
-                                doh_critical_flag varchar(1)
+                                doh_critical_flag varchar(1),
+                                doh_fingerprint char(32) UNIQUE
                             )
                             '''.format(doh_inspections_table_name = DOH_INSPECTIONS_TABLE_NAME,
                                         doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
@@ -231,7 +457,7 @@ class DohInspectionsTableBuilder(DOHTableBuilder):
 
         insert_records_q_template = u'''
                                     INSERT INTO {doh_inspections_table_name} 
-                                    (doh_camis, doh_inspection_type, doh_inspection_date, doh_action, doh_score, doh_grade, doh_grade_date, doh_violation_code, doh_critical_flag)
+                                    (doh_camis, doh_inspection_type, doh_inspection_date, doh_action, doh_score, doh_grade, doh_grade_date, doh_violation_code, doh_critical_flag, doh_fingerprint)
                                     VALUES (
                                         %(doh_camis)s,
                                         %(doh_inspection_type)s,
@@ -241,10 +467,37 @@ class DohInspectionsTableBuilder(DOHTableBuilder):
                                         %(doh_grade)s,
                                         %(doh_grade_date)s,
                                         %(doh_violation_code)s,
-                                        %(doh_critical_flag)s
+                                        %(doh_critical_flag)s,
+                                        %(doh_fingerprint)s
                                     );
                                     '''.format(doh_inspections_table_name = DOH_INSPECTIONS_TABLE_NAME)
 
+        # an inspection changed upstream (score, grade, action) gets a new 
+        # fingerprint; the new version is inserted and the old one deleted as stale.
+        delete_stale_rows = True
+
+        delta_q_template = u'''
+                            INSERT INTO {doh_inspections_table_name} 
+                            (doh_camis, doh_inspection_type, doh_inspection_date, doh_action, doh_score, doh_grade, doh_grade_date, doh_violation_code, doh_critical_flag, doh_fingerprint)
+                            VALUES %s
+                            ON CONFLICT (doh_fingerprint) DO NOTHING;
+                            '''.format(doh_inspections_table_name = DOH_INSPECTIONS_TABLE_NAME)
+
+        def _format_extracts(self, extracts):
+            '''The export can hold identical rows, so each fingerprint also covers 
+            how many identical rows came before it.'''
+
+            occurrences = {}
+            for extract in extracts:
+
+                d = extract._asdict()
+                fingerprint = self._fingerprint(d)
+                occurrence = occurrences.get(fingerprint, 0)
+                occurrences[fingerprint] = occurrence + 1
+
+                d['doh_fingerprint'] = self._fingerprint(d, '#{0}'.format(occurrence)) if occurrence else fingerprint
+                yield d
+
     # def __init__(self):
 
     #     TableBuilder.__init__(self)
@@ -302,6 +555,41 @@ class DohInspectionsTableBuilder(DOHTableBuilder):
 ####--------------------------------------------------------------------------------------------------------####
 
 
+class DohTablesLoader(object):
+    '''Loads doh_inspections and doh_restaurants from a single traversal of the 
+    cleaned extracts. Inspections are written as they stream past while a 
+    RestaurantAggregator collects the restaurant rows, which are written 
+    afterwards in the same transaction; the deferrable foreign key is only 
+    checked at commit.'''
+
+    def __init__(self):
+
+        self.restaurants_tb = DohRestaurantsTableBuilder()
+        self.inspections_tb = DohInspectionsTableBuilder()
+
+    def create_tables(self):
+
+        self.restaurants_tb.create_table()
+        self.inspections_tb.create_table()
+
+    def add_records(self, extracts, batch_size = INSERT_BATCH_SIZE, load_method = None):
+
+        aggregator = RestaurantAggregator()
+
+        with DBConnContextManager() as cm:
+            with cm.conn.cursor() as c:
+
+                c.execute("SET CONSTRAINTS ALL DEFERRED;")
+
+                self.inspections_tb.write_records(c, aggregator.consume(extracts), batch_size, load_method)
+                self.restaurants_tb.write_summaries(c, aggregator.summaries(), batch_size, load_method)
+
+
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+
+
 class YelpRestaurantsTableBuilder(TableBuilder):
 
     create_table_q = '''
@@ -403,25 +691,25 @@ class YelpRestaurantsTableBuilder(TableBuilder):
 
 class YelpCategoriesTableBuilder(NestedExtractTableBuilder):
 
-        create_table_q = '''
-                            CREATE TABLE {yelp_categories_table_name} (
-                                doh_camis varchar(8) REFERENCES {doh_restaurants_table_name},
-                                yelp_category varchar(35)
-                            )
-                            '''.format(yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME,
-                                       doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
+    create_table_q = '''
+                        CREATE TABLE {yelp_categories_table_name} (
+                            doh_camis varchar(8) REFERENCES {doh_restaurants_table_name},
+                            yelp_category varchar(35)
+                        )
+                        '''.format(yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME,
+                                   doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
 
-        drop_table_q = 'DROP TABLE IF EXISTS {yelp_categories_table_name} CASCADE'.format(
-                                        yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME)
+    drop_table_q = 'DROP TABLE IF EXISTS {yelp_categories_table_name} CASCADE'.format(
+                                    yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME)
 
-        insert_records_q_template =  u'''
-                                        INSERT INTO {yelp_categories_table_name} 
-                                        (doh_camis, yelp_category)
-                                        VALUES (
-                                            %(doh_camis)s,
-                                            %(yelp_category)s
-                                        );
-                                        '''.format(yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME)
+    insert_records_q_template =  u'''
+                                    INSERT INTO {yelp_categories_table_name} 
+                                    (doh_camis, yelp_category)
+                                    VALUES (
+                                        %(doh_camis)s,
+                                        %(yelp_category)s
+                                    );
+                                    '''.format(yelp_categories_table_name = YELP_CATEGORIES_TABLE_NAME)
 
     def __init__(self):
 
@@ -477,24 +765,24 @@ class YelpCategoriesTableBuilder(NestedExtractTableBuilder):
 
 class YelpNeighborhoodsTableBuilder(NestedExtractTableBuilder):
 
-        create_table_q = '''
-                            CREATE TABLE {yelp_neighborhoods_table_name} (
-                                doh_camis varchar(8) REFERENCES {doh_restaurants_table_name},
-                                yelp_neighborhood varchar(40)
-                            )
-                        '''.format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME,
-                                        doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
+    create_table_q = '''
+                        CREATE TABLE {yelp_neighborhoods_table_name} (
+                            doh_camis varchar(8) REFERENCES {doh_restaurants_table_name},
+                            yelp_neighborhood varchar(40)
+                        )
+                    '''.format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME,
+                                    doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME)
 
-        drop_table_q = "DROP TABLE IF EXISTS {yelp_neighborhoods_table_name} CASCADE".format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME)
+    drop_table_q = "DROP TABLE IF EXISTS {yelp_neighborhoods_table_name} CASCADE".format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME)
 
-        insert_records_q_template = u'''
-                                        INSERT INTO {yelp_neighborhoods_table_name} 
-                                        (doh_camis, yelp_neighborhood)
-                                        VALUES (
-                                            %(doh_camis)s,
-                                            %(yelp_neighborhood)s
-                                        );
-                                    '''.format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME)
+    insert_records_q_template = u'''
+                                    INSERT INTO {yelp_neighborhoods_table_name} 
+                                    (doh_camis, yelp_neighborhood)
+                                    VALUES (
+                                        %(doh_camis)s,
+                                        %(yelp_neighborhood)s
+                                    );
+                                '''.format(yelp_neighborhoods_table_name = YELP_NEIGHBORHOODS_TABLE_NAME)
 
 
     # def __init__(self):
@@ -552,6 +840,92 @@ class YelpNeighborhoodsTableBuilder(NestedExtractTableBuilder):
 
 
 
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+
+
+class YelpPullProgressTableBuilder(TableBuilder):
+    '''One row per pull pass, holding the last doh_camis whose yelp results 
+    are committed. A restarted pull resumes after it.'''
+
+    create_table_q = '''
+                        CREATE TABLE IF NOT EXISTS {yelp_pull_progress_table_name} (
+                            pull_pass varchar(20) PRIMARY KEY,
+                            last_camis varchar(10),
+                            updated_at timestamp DEFAULT now()
+                        )
+                        '''.format(yelp_pull_progress_table_name = YELP_PULL_PROGRESS_TABLE_NAME)
+
+    drop_table_q = "DROP TABLE IF EXISTS {yelp_pull_progress_table_name}".format(
+                                    yelp_pull_progress_table_name = YELP_PULL_PROGRESS_TABLE_NAME)
+
+    record_progress_q_template = '''
+                                INSERT INTO {yelp_pull_progress_table_name} (pull_pass, last_camis)
+                                VALUES (%(pull_pass)s, %(last_camis)s)
+                                ON CONFLICT (pull_pass) DO UPDATE 
+                                SET last_camis = EXCLUDED.last_camis, updated_at = now();
+                                '''.format(yelp_pull_progress_table_name = YELP_PULL_PROGRESS_TABLE_NAME)
+
+    def ensure_table(self):
+        '''Create the table if it is missing, keeping any saved progress.'''
+
+        with DBConnContextManager() as cm:
+            with cm.conn.cursor() as c:
+                c.execute(self.create_table_q)
+
+    def last_camis(self, pull_pass):
+
+        with DBConnContextManager() as cm:
+            with cm.conn.cursor() as c:
+                c.execute("SELECT last_camis FROM {yelp_pull_progress_table_name} WHERE pull_pass = %s;".format(
+                                    yelp_pull_progress_table_name = YELP_PULL_PROGRESS_TABLE_NAME), (pull_pass,))
+                row = c.fetchone()
+
+        return row[0] if row is not None else None
+
+    def record_progress(self, c, pull_pass, last_camis):
+        '''Save the pass' position on the caller's cursor, in its transaction.'''
+
+        c.execute(self.record_progress_q_template, {'pull_pass':pull_pass, 'last_camis':last_camis})
+
+
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------------####
+
+
+class YelpTablesLoader(object):
+    '''Writes matched (Record, RestaurantYelpExtract) tuples to yelp_restaurants, 
+    yelp_categories and yelp_neighborhoods, and the pull pass' progress, in one 
+    transaction, so the progress table never runs ahead of (or behind) the 
+    results it describes.'''
+
+    def __init__(self):
+
+        self.table_builders = [ YelpRestaurantsTableBuilder(), 
+                                YelpCategoriesTableBuilder(), 
+                                YelpNeighborhoodsTableBuilder() ]
+        self.progress_tb = YelpPullProgressTableBuilder()
+
+    def create_tables(self):
+
+        for table_builder in self.table_builders:
+            table_builder.create_table()
+        self.progress_tb.create_table()
+
+    def add_records(self, matched_extracts, pull_pass = None, last_camis = None, batch_size = INSERT_BATCH_SIZE):
+
+        with DBConnContextManager() as cm:
+            with cm.conn.cursor() as c:
+
+                for table_builder in self.table_builders:
+                    table_builder.write_records(c, matched_extracts, batch_size)
+
+                if pull_pass is not None:
+                    self.progress_tb.record_progress(c, pull_pass, last_camis)
+
+
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------------####
@@ -559,28 +933,28 @@ class YelpNeighborhoodsTableBuilder(NestedExtractTableBuilder):
     
 class YelpReviewsTableBuilder(NestedExtractTableBuilder):
     
-        create_table_q = '''
-                            CREATE TABLE {yelp_reviews_table_name} (
-                                yelp_id varchar(80),
-                                yelp_date date,
-                                yelp_rating real,
-                                yelp_review varchar(5000)
-                            )
-                            '''.format(yelp_restaurants_table_name = YELP_REVIEWS_TABLE_NAME)
+    create_table_q = '''
+                        CREATE TABLE {yelp_reviews_table_name} (
+                            yelp_id varchar(80),
+                            yelp_date date,
+                            yelp_rating real,
+                            yelp_review varchar(5000)
+                        )
+                        '''.format(yelp_reviews_table_name = YELP_REVIEWS_TABLE_NAME)
 
-        drop_table_q = "DROP TABLE IF EXISTS {yelp_reviews_table_name} CASCADE".format(
-                            yelp_reviews_table_name = YELP_REVIEWS_TABLE_NAME)    
+    drop_table_q = "DROP TABLE IF EXISTS {yelp_reviews_table_name} CASCADE".format(
+                        yelp_reviews_table_name = YELP_REVIEWS_TABLE_NAME)    
 
-        insert_records_q_template = u'''
-                                    INSERT INTO {yelp_reviews_table_name} 
-                                    (yelp_id, yelp_date, yelp_rating, yelp_review)
-                                    VALUES (
-                                        %(yelp_id)s,
-                                        %(yelp_date)s,
-                                        %(yelp_rating)s,
-                                        %(yelp_review)s
-                                    );
-                                    '''.format(yelp_reviews_table_name = YELP_REVIEWS_TABLE_NAME)
+    insert_records_q_template = u'''
+                                INSERT INTO {yelp_reviews_table_name} 
+                                (yelp_id, yelp_date, yelp_rating, yelp_review)
+                                VALUES (
+                                    %(yelp_id)s,
+                                    %(yelp_date)s,
+                                    %(yelp_rating)s,
+                                    %(yelp_review)s
+                                );
+                                '''.format(yelp_reviews_table_name = YELP_REVIEWS_TABLE_NAME)
 
 
     def _format_extract(self, restaurant_extract):
@@ -1,31 +1,46 @@
 # -*- coding: utf-8 -*-
 
-from constants import RAW_INSPECTION_CSV_URL, RAW_INSPECTION_CSV_PATH
+import argparse
+
+from constants import RAW_INSPECTION_CSV_URL, RAW_INSPECTION_CSV_PATH, CLEAN_INSPECTION_CACHE_PATH
 from inspection_data_machinery import InspectionDataRetriever, InspectionRecordCleaner, InspectionDataCleaner
-from table_builders import DohRestaurantsTableBuilder, DohInspectionsTableBuilder
+from table_builders import DohRestaurantsTableBuilder, DohInspectionsTableBuilder, DohTablesLoader
 
 
-if __name__ == '__main__':
+def build_argparser():
 
-    retriever = InspectionDataRetriever()
-    cleaner = InspectionDataCleaner()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--delta', help = 'Only write rows that changed since the last load.', dest = 'delta', action = 'store_true')
+    parser.add_argument('-k', '--cache', help = 'Reuse (or build) the columnar cache of the cleaned csv.', dest = 'cache', action = 'store_true')
 
-    retriever.retrieve(RAW_INSPECTION_CSV_URL)
-    retriever.save(RAW_INSPECTION_CSV_PATH)
+    parser.set_defaults(delta = False, cache = False)
 
-    extracts = cleaner.clean(RAW_INSPECTION_CSV_PATH)
+    return parser
 
-    doh_restaurants_tb = DohRestaurantsTableBuilder()
-    doh_inspections_tb = DohInspectionsTableBuilder()
 
-    doh_restaurants_tb.build_table(extracts)
-    doh_inspections_tb.build_table(extracts)
+if __name__ == '__main__':
 
-    
+    parser = build_argparser()
+    args = parser.parse_args()
 
+    retriever = InspectionDataRetriever()
+    cleaner = InspectionDataCleaner(cache_path = CLEAN_INSPECTION_CACHE_PATH if args.cache else None)
 
+    changed = retriever.stream_retrieve(RAW_INSPECTION_CSV_URL, RAW_INSPECTION_CSV_PATH)
 
+    doh_restaurants_tb = DohRestaurantsTableBuilder()
+    doh_inspections_tb = DohInspectionsTableBuilder()
 
+    if args.delta:
 
+        if changed:
+            # restaurants first, new inspections may reference new restaurants.
+            doh_restaurants_tb.add_delta_records(cleaner.clean_iter(RAW_INSPECTION_CSV_PATH))
+            doh_inspections_tb.add_delta_records(cleaner.clean_iter(RAW_INSPECTION_CSV_PATH))
 
+    else:
 
+        # both tables are loaded from one streaming pass over the csv.
+        doh_tables_loader = DohTablesLoader()
+        doh_tables_loader.create_tables()
+        doh_tables_loader.add_records(cleaner.clean_iter(RAW_INSPECTION_CSV_PATH))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from inspection_data_machinery import CompiledRecordCleaner, RestaurantAggregator
+from synthetic_inspection_data import SyntheticInspectionDataGenerator, DOH_CSV_HEADER
+from yelp_api_machinery import YelpApiPhoneInterfacer, YelpApiAddressInterfacer, RetryPolicy, YelpResponseCache
+from mock_yelp_api import MockYelpApiServer, SEARCH_PATH, PHONE_SEARCH_PATH
+
+
+class TimedSession(object):
+    '''Wraps an interfacer's session.get, recording each request's latency and
+    status code.'''
+
+    def __init__(self, session, retry_policy):
+
+        self.session = session
+        self.retry_policy = retry_policy
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.n_retried = 0
+
+    def get(self, *args, **kwargs):
+
+        start = time.time()
+        response = self.session.get(*args, **kwargs)
+        latency = time.time() - start
+
+        with self.lock:
+            self.latencies.append(latency)
+            self.n_retried += self.retry_policy.should_retry(response)
+
+        return response
+
+
+def synthetic_restaurants(n_rows, seed):
+
+    clean_row = CompiledRecordCleaner().compile(DOH_CSV_HEADER)
+    aggregator = RestaurantAggregator()
+
+    for _ in aggregator.consume(clean_row(row) for row in SyntheticInspectionDataGenerator(seed = seed).rows(n_rows)):
+        pass
+
+    return list(aggregator.summaries())
+
+
+def percentile(sorted_values, p):
+
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def load_test(name, interfacer, restaurants):
+
+    timed_session = TimedSession(interfacer.session, interfacer.retry_policy)
+    interfacer.session = timed_session
+
+    start = time.time()
+    restaurant_infos = interfacer.pull_restaurants(restaurants)
+    elapsed = time.time() - start
+
+    assert len(restaurant_infos) == len(restaurants)
+
+    latencies = sorted(timed_session.latencies)
+    print "{0:<8} {1:>6} restaurants {2:>8.1f}/sec  {3:>6} requests {4:>8.1f}/sec  {5:>5} retried  " \
+            "latency p50 {6:.3f} p90 {7:.3f} p99 {8:.3f} s".format(
+                    name, len(restaurants), len(restaurants) / elapsed, len(latencies), len(latencies) / elapsed,
+                    timed_session.n_retried, percentile(latencies, .5), percentile(latencies, .9), percentile(latencies, .99))
+
+
+def non_ascii_restaurants(restaurants):
+    '''The restaurants with utf-8 byte string dbas and addresses, as doh 
+    spells some of them.'''
+
+    return [r._replace(doh_dba = 'CAF\xc3\x89 {0}'.format(r.doh_dba), 
+                        doh_address = '{0} PE\xc3\x91A'.format(r.doh_address)) for r in restaurants]
+
+
+def cache_test(server, retry_policy, restaurants):
+    '''Pulls the restaurants twice through a fresh response cache: the second
+    pull must be served from it entirely.'''
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        response_cache = YelpResponseCache(cache_path = os.path.join(cache_dir, 'responses.sqlite'))
+        for _ in range(2):
+            interfacer = YelpApiAddressInterfacer(base_url = server.url(SEARCH_PATH), limit = 15, sort = 1,
+                                        retry_policy = retry_policy, response_cache = response_cache,
+                                        report_interval = len(restaurants) + 1)
+            assert len(interfacer.pull_restaurants(restaurants)) == len(restaurants)
+
+        # a response that failed every retry is not cached, so is missed twice.
+        assert response_cache.hits + response_cache.misses == 2 * len(restaurants)
+        assert response_cache.misses < len(restaurants) + len(restaurants) / 10
+        print "cached   {0:>6} non-ascii restaurants  {1:>6} hits {2:>6} misses".format(
+                                        len(restaurants), response_cache.hits, response_cache.misses)
+        response_cache.close()
+
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_rows', help = 'Synthetic inspection rows to draw restaurants from.', required = False)
+    parser.add_argument('-t', '--threads', help = 'Concurrent api requests.', required = False)
+    parser.add_argument('-l', '--latency', help = 'Mean mock response latency in seconds.', required = False)
+    parser.add_argument('-e', '--error_rate', help = 'Fraction of mock responses that are 500s or 503s.', required = False)
+    parser.add_argument('-q', '--throttle_rate', help = 'Fraction of mock responses that are 429s.', required = False)
+    parser.add_argument('-s', '--seed', help = 'Synthetic data and mock server seed.', required = False)
+
+    parser.set_defaults(n_rows = 5000, threads = 8, latency = .05, error_rate = .02, throttle_rate = .02, seed = 0)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    restaurants = synthetic_restaurants(int(args.n_rows), int(args.seed))
+    n_threads = int(args.threads)
+
+    # short waits, so the retries exercise the policy without dominating the run.
+    retry_policy = RetryPolicy(max_attempts = 5, backoff_base = .01, backoff_max = .1)
+
+    with MockYelpApiServer(latency = float(args.latency), error_rate = float(args.error_rate),
+                            throttle_rate = float(args.throttle_rate), retry_after = 0, seed = int(args.seed)) as server:
+
+        phone_interfacer = YelpApiPhoneInterfacer(base_url = server.url(PHONE_SEARCH_PATH), n_threads = n_threads,
+                                        retry_policy = retry_policy, report_interval = len(restaurants) + 1)
+        load_test('phone', phone_interfacer, restaurants)
+        phone_interfacer.report_dedupe_savings()
+
+        address_interfacer = YelpApiAddressInterfacer(base_url = server.url(SEARCH_PATH), limit = 15, sort = 1,
+                                        n_threads = n_threads, retry_policy = retry_policy,
+                                        report_interval = len(restaurants) + 1)
+        load_test('address', address_interfacer, restaurants)
+
+        cache_test(server, retry_policy, non_ascii_restaurants(restaurants[:200]))
+
+        print "Mock responses by status: {0}".format(server.status_counts)
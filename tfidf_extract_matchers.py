@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import scipy.sparse as sp
+
+from constants import LOWER_SIMILARITY_THRESHOLD, UPPER_SIMILARITY_THRESHOLD, \
+                    ADDRESS_SCORE_WEIGHT, NAME_SCORE_WEIGHT, TFIDF_NGRAM_SIZE
+from extract_matchers import ByAddressExtractMatcher
+
+
+class CharNgramVectorizer(object):
+    '''Turns strings into l2 normalized tf-idf vectors over their character
+    n-grams (padded with a space each side), as the rows of a csr matrix. The
+    vocabulary and idf come from the texts given to fit_transform.'''
+
+    def __init__(self, n = TFIDF_NGRAM_SIZE):
+
+        self.n = n
+
+    def fit_transform(self, texts):
+
+        padded = [' {0} '.format(text.encode('utf-8') if isinstance(text, unicode) else text) if text else ''
+                    for text in texts]
+        lengths = np.array([len(text) for text in padded], dtype = np.int64)
+        starts = np.r_[0, np.cumsum(lengths)[:-1]]
+
+        # every n-gram of the concatenated texts as one integer, byte by byte; 
+        # those running across a boundary between texts are dropped.
+        text_bytes = np.frombuffer(''.join(padded), dtype = np.uint8).astype(np.int64)
+        n_positions = max(len(text_bytes) - self.n + 1, 0)
+        codes = np.zeros(n_positions, dtype = np.int64)
+        for k in range(self.n):
+            codes = (codes << 8) | text_bytes[k:k + n_positions]
+
+        rows = np.repeat(np.arange(len(padded)), lengths)[:n_positions]
+        valid = np.arange(n_positions) - starts[rows] <= lengths[rows] - self.n
+        vocabulary, columns = np.unique(codes[valid], return_inverse = True)
+
+        # duplicate (row, column) entries are summed into counts.
+        matrix = sp.csr_matrix((np.ones(len(columns)), (rows[valid], columns)),
+                                    shape = (len(padded), max(len(vocabulary), 1)))
+        matrix.sum_duplicates()
+
+        # smoothed idf, as if one more text had every n-gram.
+        document_frequency = np.bincount(matrix.indices, minlength = matrix.shape[1])
+        matrix = matrix * sp.diags(np.log((1. + matrix.shape[0]) / (1. + document_frequency)) + 1.)
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel())
+        norms[norms == 0] = 1.
+        return sp.diags(1. / norms) * matrix
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class TfidfAddressExtractMatcher(ByAddressExtractMatcher):
+    '''ByAddressExtractMatcher that scores a whole batch of (Record,
+    RestaurantYelpExtractList) tuples at once. Names and addresses become
+    character n-gram tf-idf vectors, every (doh, candidate) similarity is the
+    row-wise product of two sparse matrices, and the threshold and weighting
+    logic runs on the resulting arrays.
+
+    The similarities are cosines, not SequenceMatcher ratios, so the same
+    thresholds can accept a slightly different set of pairs.'''
+
+    def __init__(self, vectorizer = None, **kwargs):
+
+        ByAddressExtractMatcher.__init__(self, **kwargs)
+        self.vectorizer = vectorizer or CharNgramVectorizer()
+
+    # a batch is already scored in a few numpy calls, not per pair in a pool.
+    _compact = None
+
+    def match_all(self, extract_tuples, n_workers = 1, chunk_size = None):
+
+        extract_tuples = list(extract_tuples)
+        best = self._best_candidates(extract_tuples)
+
+        matched_extract_tuples = [  (doh_extract, yelp_extracts[best[i]])
+                                    for i, (doh_extract, yelp_extracts) in enumerate(extract_tuples)
+                                    if best[i] is not None ]
+
+        self._report_match_results(matched_extract_tuples)
+        return matched_extract_tuples
+
+    def match(self, extract_tuple):
+
+        best = self._best_candidates([extract_tuple])[0]
+        if best is None:
+            return None
+
+        doh_extract, yelp_extracts = extract_tuple
+        return (doh_extract, yelp_extracts[best])
+
+    def _best_candidates(self, extract_tuples):
+        '''For each extract tuple, the index of its best scoring candidate, or
+        None if none scores above 0.'''
+
+        doh_rows = []
+        candidate_rows = []
+        candidates = []
+        for i, (doh_extract, yelp_extracts) in enumerate(extract_tuples):
+            for yelp_extract in yelp_extracts:
+                doh_rows.append(i)
+                candidate_rows.append(len(candidates))
+                candidates.append(yelp_extract)
+
+        best = [None] * len(extract_tuples)
+        if not candidates:
+            return best
+
+        doh_extracts = [doh_extract for doh_extract, _ in extract_tuples]
+        address_scores = self._pair_similarities(   [d.doh_address for d in doh_extracts],
+                                                    [y.yelp_address for y in candidates],
+                                                    doh_rows, candidate_rows, self.canonicalizer.address)
+        name_scores = self._pair_similarities(  [d.doh_dba for d in doh_extracts],
+                                                [y.yelp_name for y in candidates],
+                                                doh_rows, candidate_rows, self.canonicalizer.name)
+
+        passed = (np.minimum(address_scores, name_scores) >= LOWER_SIMILARITY_THRESHOLD) & \
+                    (np.maximum(address_scores, name_scores) >= UPPER_SIMILARITY_THRESHOLD)
+        scores = np.where(passed, ADDRESS_SCORE_WEIGHT*address_scores + NAME_SCORE_WEIGHT*name_scores, 0)
+
+        # pairs are grouped by doh extract, in candidate order; the first of
+        # equal best scores wins, as in the stable sort of _score_extracts.
+        doh_rows = np.array(doh_rows)
+        starts = np.flatnonzero(np.r_[True, doh_rows[1:] != doh_rows[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(doh_rows)]):
+            j = start + int(np.argmax(scores[start:end]))
+            if scores[j] > 0:
+                best[doh_rows[j]] = candidate_rows[j] - candidate_rows[start]
+
+        return best
+
+    def _pair_similarities(self, doh_texts, candidate_texts, doh_rows, candidate_rows, canonicalize):
+
+        texts = [canonicalize(text) if text is not None else '' for text in doh_texts + candidate_texts]
+        vectors = self.vectorizer.fit_transform(texts)
+
+        doh_vectors = vectors[:len(doh_texts)][doh_rows]
+        candidate_vectors = vectors[len(doh_texts):][candidate_rows]
+
+        return np.asarray(doh_vectors.multiply(candidate_vectors).sum(axis = 1)).ravel()
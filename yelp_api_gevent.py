@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# gevent has to patch the socket, ssl and threading modules before requests
+# (and urllib3 under it) import them, so this module must be imported before
+# yelp_api_machinery, or the entry point must patch first (as
+# yelp_restaurant_pull_driver does with --gevent).
+from gevent import monkey
+monkey.patch_all()
+
+from gevent.pool import Pool
+
+from yelp_api_machinery import YelpApiPhoneInterfacer, YelpApiAddressInterfacer, TokenBucket
+
+
+class GeventPullMixin():
+    '''Runs _pull_indexed_restaurant in up to max_concurrency greenlets on one
+    event loop instead of a thread per request. imap keeps the input order, so
+    pull_restaurants returns the same (restaurant, extracts) tuples as the
+    serial and threaded pulls.'''
+
+    def _build_pool(self):
+
+        return Pool(self.n_threads)
+
+    def _shutdown_pool(self, pool):
+
+        pool.join()
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class GeventYelpApiPhoneInterfacer(GeventPullMixin, YelpApiPhoneInterfacer):
+
+    def __init__(self, max_concurrency = 100, requests_per_second = 10, rate_limiter = None, **kwargs):
+
+        YelpApiPhoneInterfacer.__init__(self,
+                                        n_threads = max_concurrency,
+                                        rate_limiter = rate_limiter or TokenBucket(requests_per_second),
+                                        **kwargs)
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class GeventYelpApiAddressInterfacer(GeventPullMixin, YelpApiAddressInterfacer):
+
+    def __init__(self, max_concurrency = 100, requests_per_second = 10, rate_limiter = None, **kwargs):
+
+        YelpApiAddressInterfacer.__init__(self,
+                                        n_threads = max_concurrency,
+                                        rate_limiter = rate_limiter or TokenBucket(requests_per_second),
+                                        **kwargs)
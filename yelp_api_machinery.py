@@ -2,18 +2,39 @@
 
 import sys
 import pdb
-from collections import namedtuple
-from operator import itemgetter
+import time
+import threading
+import json
+import sqlite3
+try:
+    import ujson as fast_json
+except ImportError:
+    import json as fast_json
+import random
+from email.utils import parsedate_tz, mktime_tz
+import re
+from collections import namedtuple, OrderedDict
 import psycopg2
 from psycopg2.extras import NamedTupleConnection
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1
+from multiprocessing.pool import ThreadPool
 from constants import   SEARCH_ADDR_BASE_URL, \
                         SEARCH_PHONE_BASE_URL, \
                         DB_NAME, \
                         DOH_INSPECTIONS_TABLE_NAME, \
                         DOH_RESTAURANTS_TABLE_NAME, \
-                        MAX_GET_ATTEMPTS
+                        YELP_RESTAURANTS_TABLE_NAME, \
+                        MAX_GET_ATTEMPTS, \
+                        RETRY_BACKOFF_BASE, \
+                        RETRY_BACKOFF_MAX, \
+                        RETRY_AFTER_MAX, \
+                        RETRY_STATUS_CODES, \
+                        QUOTA_WINDOW, \
+                        YELP_RESPONSE_CACHE_PATH, \
+                        YELP_RESPONSE_CACHE_TTL, \
+                        YELP_RESPONSE_CACHE_MAX_ENTRIES
 from secret_constants import CONSUMER_KEY, CONSUMER_SECRET, TOKEN, TOKEN_SECRET
 
 
@@ -32,73 +53,229 @@ RESTAURANT_YELP_EXTRACT_FIELDS = [
 
 RestaurantYelpExtract = namedtuple('RestaurantYelpExtract', RESTAURANT_YELP_EXTRACT_FIELDS)
 
+NON_DIGIT_RE = re.compile(r'\D')
+
 
 class YelpApiResponseParser():
     ''' Parse method takes the json style response and 
-    extracts the restaurant informtion for every business in the list.'''
+    extracts the restaurant informtion for every business in the list.
+
+    Each extract is built straight from the business dict, reading only the 
+    fields we store. decode uses ujson when it is installed.'''
+
+    def decode(self, body):
+
+        return fast_json.loads(body)
         
     def parse(self, response_json):
         
         if response_json.get('total') == 0:
             return []
         
-        restaurant_extracts = []
-        for restaurant_dict in response_json.get('businesses'):
-            
-            restaurant_attributes = self._get_attributes(restaurant_dict)            
+        return [self._build_restaurant_extract(restaurant_dict) 
+                    for restaurant_dict in response_json.get('businesses')]
 
-            restaurant_extract = self._build_restaurant_extract(restaurant_attributes)
+    def _build_restaurant_extract(self, restaurant_dict):
 
-            restaurant_extracts.append(restaurant_extract)
-            
-        return restaurant_extracts
+        # if a 'get' fails in any of the following, use the empty type of
+        # the type that would be returned on success.
+        location = restaurant_dict.get('location') or {}
+        address = location.get('address')
+
+        return tuple.__new__(RestaurantYelpExtract, (
+                    restaurant_dict.get('name', ''),
+                    restaurant_dict.get('id', ''),
+                    address[0] if address else '',
+                    location.get('city', ''),
+                    location.get('postal_code', ''),
+                    restaurant_dict.get('phone', '').replace('+',''),
+                    restaurant_dict.get('review_count'),
+                    restaurant_dict.get('rating'),
+                    [category[0] for category in restaurant_dict.get('categories', ())],
+                    location.get('neighborhoods', []),
+                    ))
 
-    def _get_attributes(self, restaurant_dict):
 
-        # if a 'get' fails in any of the following, return the empty type of
-        # the type that would be returned on success.
-        
-        #id info
-        yelp_name = restaurant_dict.get('name', '')
-        yelp_id = restaurant_dict.get('id', '')
-        yelp_phone = restaurant_dict.get('phone', '').replace('+','')
-        
-        #location info
-        location = restaurant_dict.get('location', '')
-        yelp_city = location.get('city', '')
-        yelp_address = location.get('address', '')
-        yelp_address = yelp_address[0] if len(yelp_address) > 0 else ''
-        yelp_zipcode = location.get('postal_code', '')
-        yelp_neighborhoods = location.get('neighborhoods', []) 
-        
-        #food/service info
-        yelp_categories = restaurant_dict.get('categories', [])
-        yelp_categories = map(itemgetter(0), yelp_categories)
-        
-        yelp_review_count = restaurant_dict.get('review_count')
-        yelp_rating = restaurant_dict.get('rating')
+####--------------------------------------------------------------------------------------------------#### 
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
 
-        restaurant_attributes = [
-                                    yelp_name,
-                                    yelp_id, 
-                                    yelp_address, 
-                                    yelp_city, 
-                                    yelp_zipcode, 
-                                    yelp_phone, 
-                                    yelp_review_count, 
-                                    yelp_rating, 
-                                    yelp_categories, 
-                                    yelp_neighborhoods
-                                ]
 
-        return restaurant_attributes
+class YelpResponseCache(object):
+    '''Disk backed (sqlite) cache of yelp api response json, keyed on the url 
+    and the normalized request payload. Entries older than ttl seconds are 
+    misses, and once there are more than max_entries the least recently used 
+    are evicted. Counts hits and misses for the run report.'''
 
-    def _build_restaurant_extract(self, restaurant_attributes):
+    def __init__(self, cache_path = YELP_RESPONSE_CACHE_PATH, ttl = YELP_RESPONSE_CACHE_TTL, 
+                                        max_entries = YELP_RESPONSE_CACHE_MAX_ENTRIES):
 
-        return RestaurantYelpExtract._make(restaurant_attributes)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # one connection shared by the pull threads, serialized by the lock.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, check_same_thread = False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                    key text PRIMARY KEY,
+                                    response_json text,
+                                    stored_at real,
+                                    accessed_at real
+                                    );''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);')
+        self.conn.commit()
+
+    def key(self, base_url, payload):
+
+        # doh values are utf-8 byte strings, and unicode() on a non-ascii one 
+        # raises; as utf-8 bytes, u'café' and 'caf\xc3\xa9' share a key.
+        return base_url + '?' + json.dumps(sorted((str(k), v.encode('utf-8') if isinstance(v, unicode) else str(v)) 
+                                                    for k, v in payload.iteritems()))
+
+    def get(self, key):
+
+        now = time.time()
+        with self.lock:
+
+            row = self.conn.execute('SELECT response_json, stored_at FROM responses WHERE key = ?;', 
+                                        (key,)).fetchone()
+
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+
+            self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?;', (now, key))
+            self.conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, key, response_json):
+
+        now = time.time()
+        with self.lock:
+
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?);', 
+                                        (key, json.dumps(response_json), now, now))
+            self._evict()
+            self.conn.commit()
+
+    def close(self):
+
+        with self.lock:
+            self.conn.close()
+
+    def _evict(self):
+
+        n_entries = self.conn.execute('SELECT count(*) FROM responses;').fetchone()[0]
+        if n_entries > self.max_entries:
+            self.conn.execute('''DELETE FROM responses WHERE key IN (
+                                    SELECT key FROM responses ORDER BY accessed_at LIMIT ?);''', 
+                                        (n_entries - self.max_entries,))
+
+
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class TokenBucket(object):
+    '''Rate limiter: on average rate acquisitions per second, with bursts of up 
+    to capacity. acquire blocks (time.sleep) until a token is available, so it 
+    can be shared between threads or, monkey patched, greenlets.'''
+
+    def __init__(self, rate, capacity = None):
+
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+
+            with self.lock:
+
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class QuotaBudget(TokenBucket):
+    '''Paces requests evenly across the quota window: the bucket refills at 
+    (quota - burst) / window tokens a second, so no window of that length sees 
+    more than quota requests, however long the run.'''
+
+    def __init__(self, quota, window = QUOTA_WINDOW, burst = 100):
+
+        burst = min(burst, quota // 2)
+        TokenBucket.__init__(self, float(quota - burst) / window, capacity = burst)
 
 
-####--------------------------------------------------------------------------------------------------#### 
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+####--------------------------------------------------------------------------------------------------####
+
+
+class RetryPolicy(object):
+    '''Which responses to retry and how long to wait before the next attempt: 
+    the server's Retry-After when it sends one (at most retry_after_max, so a 
+    bad header cannot stall a worker for hours), else exponential backoff 
+    with full jitter.'''
+
+    def __init__(self, max_attempts = MAX_GET_ATTEMPTS, backoff_base = RETRY_BACKOFF_BASE, 
+                                        backoff_max = RETRY_BACKOFF_MAX, retry_after_max = RETRY_AFTER_MAX, 
+                                        retry_status_codes = RETRY_STATUS_CODES):
+
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.retry_status_codes = retry_status_codes
+
+    def should_retry(self, response):
+
+        return response.status_code in self.retry_status_codes
+
+    def delay(self, attempt, response = None):
+
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.retry_after_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, response):
+        '''Seconds to wait from a Retry-After header, in either delta-seconds 
+        or http-date form.'''
+
+        if response is None or not response.headers.get('Retry-After'):
+            return None
+
+        retry_after = response.headers['Retry-After']
+        try:
+            return max(0., float(retry_after))
+
+        except ValueError:
+            date = parsedate_tz(retry_after)
+            if date is None:
+                return None
+            return max(0., mktime_tz(date) - time.time())
+
+
+####--------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------####
 
@@ -108,7 +285,8 @@ class YelpApiInterfacer():
     with the yelp api, then passes the response to a response parser.
     '''
     
-    def __init__(self, report_interval = 500):
+    def __init__(self, report_interval = 500, n_threads = 1, rate_limiter = None, response_cache = None, 
+                                        retry_policy = None):
         
         self.AUTH = OAuth1( CONSUMER_KEY, 
                             CONSUMER_SECRET,
@@ -116,11 +294,29 @@ class YelpApiInterfacer():
                             TOKEN_SECRET)
 
         self.report_interval = report_interval
+        self.n_threads = n_threads
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.retry_policy = retry_policy or RetryPolicy()
         self.parser = YelpApiResponseParser()
+
+        # one keep-alive connection pool shared by every request (and thread), 
+        # with the OAuth1 signer attached once.
+        self.session = requests.Session()
+        self.session.auth = self.AUTH
+        adapter = HTTPAdapter(pool_connections = 2, pool_maxsize = max(n_threads, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def pull_restaurants(self, restaurants):
+        '''restaurants may be a list or any iterable (e.g. rows streamed from a 
+        cursor), in which case the total is only known at the end.'''
+
+        if self.n_threads > 1:
+            return self._pull_restaurants_concurrently(restaurants)
         
         restaurant_infos = []
+        n_restaurants = len(restaurants) if hasattr(restaurants, '__len__') else None
 
         for i, r in enumerate(restaurants):
             
@@ -128,9 +324,46 @@ class YelpApiInterfacer():
 
             restaurant_infos.append(self._pull_restaurant(r))
             
-            self._report_pull_progress_completed(i, len(restaurants))
-        
+            self._report_pull_progress_completed(i, n_restaurants)
+
+        self._report_pull_completed(len(restaurant_infos))
         return restaurant_infos
+
+    def _pull_restaurants_concurrently(self, restaurants):
+        '''Same as the sequential pull, but up to n_threads requests are in 
+        flight at once. Results come back in the order of restaurants.'''
+
+        restaurant_infos = []
+        n_restaurants = len(restaurants) if hasattr(restaurants, '__len__') else None
+
+        pool = self._build_pool()
+        try:
+            indexed_restaurants = ((i, r, n_restaurants) for i, r in enumerate(restaurants))
+            for i, restaurant_info in enumerate(pool.imap(self._pull_indexed_restaurant, indexed_restaurants)):
+
+                restaurant_infos.append(restaurant_info)
+
+                self._report_pull_progress_completed(i, n_restaurants)
+        finally:
+            self._shutdown_pool(pool)
+
+        self._report_pull_completed(len(restaurant_infos))
+        return restaurant_infos
+
+    def _build_pool(self):
+
+        return ThreadPool(self.n_threads)
+
+    def _shutdown_pool(self, pool):
+
+        pool.close()
+        pool.join()
+
+    def _pull_indexed_restaurant(self, indexed_restaurant):
+
+        i, r, n_restaurants = indexed_restaurant
+        self._report_pull_progress_init(i, n_restaurants)
+        return self._pull_restaurant(r)
          
 
     def _pull_restaurant(self, restaurant_tuple):
@@ -138,35 +371,60 @@ class YelpApiInterfacer():
 
 
     def _fetch(self, restaurant_tuple, payload, base_url):
+
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(base_url, payload)
+            response_json = self.response_cache.get(cache_key)
+            if response_json is not None:
+                return self.parser.parse(response_json)
         
         response = None
-        for _ in range(MAX_GET_ATTEMPTS):
+        for attempt in range(self.retry_policy.max_attempts):
+
+            if attempt:
+                time.sleep(self.retry_policy.delay(attempt - 1, response))
             
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
             try:
-                response = requests.get(url = base_url, params = payload, auth = self.AUTH)
-                break
+                response = self.session.get(url = base_url, params = payload)
             except requests.ConnectionError:
+                response = None
                 self._report_connection_error(restaurant_tuple, payload)
+                continue
+
+            if not self.retry_policy.should_retry(response):
+                break
+
+            self._report_status_error(restaurant_tuple, response)
 
-        if response is None:
+        else:
             return []
          
+        # decoded once, here, and reused by the error report and the cache.
+        response_json = self.parser.decode(response.content)
+
         try:
-            return self.parser.parse(response.json())
+            extracts = self.parser.parse(response_json)
         
         except:
-            self._report_parse_error(restaurant_tuple, response)
-            response_json = response.json()
+            self._report_parse_error(restaurant_tuple, response_json)
             if 'error' in response_json:
                 return []
 
             else:
                 raise
 
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, response_json)
+
+        return extracts
+
     #     MAKE INTO SEPERATE CLASS?
     def _report_pull_progress_init(self, i, total):
 
-        if i == 0:
+        if i == 0 and total is not None:
             print "{0} Restaurants to pull.".format(total)
 
         if not (i % self.report_interval):
@@ -180,10 +438,17 @@ class YelpApiInterfacer():
         if not (i % self.report_interval):     
             print "Restaurant {0} completed.".format(i)
 
-        if i == total - 1:
+        sys.stdout.flush()   
+
+    def _report_pull_completed(self, total):
+
+        if total:
             print "Completion: {0} restaurants pulled.".format(total)
+            if self.response_cache is not None:
+                print "Response cache: {0} hits, {1} misses.".format(self.response_cache.hits, 
+                                                                    self.response_cache.misses)
 
-        sys.stdout.flush()   
+        sys.stdout.flush()
 
 
     def _report_error(self, messages):
@@ -196,18 +461,30 @@ class YelpApiInterfacer():
             print '*'*60
 
 
-    def _report_parse_error(self, restaurant_tuple, response):
+    def _report_parse_error(self, restaurant_tuple, response_json):
 
             messages = [
                         'Could not parse response.',
                         restaurant_tuple._asdict(),
-                        response.json(),
+                        response_json,
                         ]
 
             self._report_error(messages)
         
         
 
+    def _report_status_error(self, restaurant_tuple, response):
+
+            messages = [
+                        'HTTP {0} encountered.'.format(response.status_code),
+                        restaurant_tuple._asdict(),
+                        "\tRetry-After:",
+                        response.headers.get('Retry-After'),
+                        ]
+
+            self._report_error(messages)
+
+
     def _report_connection_error(self, restaurant_tuple, payload):
             
             messages = [
@@ -228,10 +505,51 @@ class YelpApiInterfacer():
 
 
 class YelpApiPhoneInterfacer(YelpApiInterfacer):
+    '''Restaurants sharing a phone number (chains, food courts, re-registered 
+    camis ids) get the same phone_search result, so each distinct number is 
+    requested once per run and the result fanned out to every restaurant 
+    with it, whichever pull_restaurants call (batch) it comes in.'''
 
-    def __init__(self, **kwargs):
+    def __init__(self, base_url = SEARCH_PHONE_BASE_URL, **kwargs):
 
         YelpApiInterfacer.__init__(self, **kwargs)
+        self.base_url = base_url
+        self.extracts_by_phone = {}
+        self.n_phone_restaurants = 0
+
+    def pull_restaurants(self, restaurants):
+
+        restaurants = list(restaurants)
+        phones = [self._normalize_phone(r.doh_phone) for r in restaurants]
+
+        # first restaurant with each number not pulled yet stands in for the rest.
+        representatives = OrderedDict()
+        for phone, r in zip(phones, restaurants):
+            if phone and phone not in self.extracts_by_phone and phone not in representatives:
+                representatives[phone] = r
+
+        pulled = YelpApiInterfacer.pull_restaurants(self, representatives.values())
+        self.extracts_by_phone.update(zip(representatives.keys(), (extract for _, extract in pulled)))
+        self.n_phone_restaurants += sum(1 for phone in phones if phone)
+
+        return [(r, self.extracts_by_phone.get(phone, [])) for phone, r in zip(phones, restaurants)]
+
+    def report_dedupe_savings(self):
+        '''Requests saved by the dedupe so far; called once the pass is done.'''
+
+        n_phone_requests = len(self.extracts_by_phone)
+        n_saved = self.n_phone_restaurants - n_phone_requests
+        print "Phone dedupe: {0} requests for {1} restaurants with phones, {2} ({3:.1%}) saved.".format(
+                                        n_phone_requests, self.n_phone_restaurants, n_saved,
+                                        n_saved / float(self.n_phone_restaurants or 1))
+        sys.stdout.flush()
+
+    def _normalize_phone(self, phone):
+
+        phone = NON_DIGIT_RE.sub('', phone or '')
+        if len(phone) == 11 and phone.startswith('1'):
+            phone = phone[1:]
+        return phone
 
     def _pull_restaurant(self, restaurant_tuple):
 
@@ -246,7 +564,7 @@ class YelpApiPhoneInterfacer(YelpApiInterfacer):
                     'limit':limit 
             }
         
-        extract = self._fetch(restaurant_tuple, payload, SEARCH_PHONE_BASE_URL) #returns a list of one if successful
+        extract = self._fetch(restaurant_tuple, payload, self.base_url) #returns a list of one if successful
         if len(extract) > 0:
             extract = extract[0]
 
@@ -260,9 +578,10 @@ class YelpApiPhoneInterfacer(YelpApiInterfacer):
 
 class YelpApiAddressInterfacer(YelpApiInterfacer):
 
-    def __init__(self, limit = 1, sort = 0, **kwargs):
+    def __init__(self, limit = 1, sort = 0, base_url = SEARCH_ADDR_BASE_URL, **kwargs):
 
         YelpApiInterfacer.__init__(self, **kwargs)
+        self.base_url = base_url
         self.limit = limit
         self.sort = sort
 
@@ -276,7 +595,7 @@ class YelpApiAddressInterfacer(YelpApiInterfacer):
             'sort':self.sort
             }
         
-        extracts = self._fetch(restaurant_table_extract, payload, SEARCH_ADDR_BASE_URL)
+        extracts = self._fetch(restaurant_table_extract, payload, self.base_url)
         return (restaurant_table_extract, extracts)        
 
 ####--------------------------------------------------------------------------------------------------####
@@ -284,15 +603,34 @@ class YelpApiAddressInterfacer(YelpApiInterfacer):
 ####--------------------------------------------------------------------------------------------------####
 
 class YelpApiCoordinator():
+    '''Reads doh restaurants in doh_camis order and sends them to the api 
+    interfacer. Batches are keyset paginated (doh_camis > the last one read) 
+    rather than OFFSET, so a late batch costs the same as an early one, and 
+    the rows are streamed from a server side cursor fetch_size at a time.
+    '''
 
-    def __init__(self, api_interfacer, start_read = 0):
+    def __init__(self, api_interfacer, start_read = 0, fetch_size = 2000):
             
         self.current = start_read
+        self.last_camis = None
+        self.fetch_size = fetch_size
         self.api_interfacer = api_interfacer
         self.conn = None
+
+        # doh_camis of the n-th restaurant after last_camis (or of the last 
+        # one, when there are fewer than n or n is NULL); NULL if there are none.
+        self.q_window_end_template = '''
+                            SELECT max(doh_camis)
+                            FROM (SELECT doh_camis
+                                    FROM {doh_restaurants_table_name}
+                                    WHERE doh_camis > %(last_camis)s
+                                    ORDER BY doh_camis ASC
+                                    LIMIT %(n)s) AS w;
+                            '''
     
     def seek(self, n):
         self.current = n
+        self.last_camis = None
 
     def open_conn(self):
         
@@ -308,39 +646,77 @@ class YelpApiCoordinator():
 
     def read_next_n(self, n):
 
-        if not self.conn:
-            self.open_conn()
-           
-        q = self.q_n_template.format(   doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME, 
-                                        n = n, 
-                                        offset = self.current)
-        try:
-            self.self.c.execute(q)
-            query_result_tuples = self.c.fetchall()
-        finally:
-            self.close_conn()
-
-        extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
+        extract_tuples = self._read(n)
         self.current += n
         return extract_tuples
 
+    def read_batches(self, n, batch_size):
+        '''read_next_n in windows of batch_size restaurants, yielding each 
+        window's extract tuples with the last doh_camis it covered, so results 
+        can be committed (and the position checkpointed) as the pull goes.'''
+
+        while n > 0:
+
+            last_camis = self.last_camis
+            extract_tuples = self.read_next_n(min(n, batch_size))
+            if not self.last_camis or self.last_camis == last_camis:
+                return
+
+            yield extract_tuples, self.last_camis
+            n -= batch_size
+
     def read_all(self):
 
+        extract_tuples = self._read(None)
+        self.seek(0)
+        return extract_tuples
+
+    def _read(self, n):
+
         if not self.conn:
             self.open_conn()
-        
-        q = self.q_all_template.format( doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME,
-                                        offset = self.current)
-        
+
         try:
-            self.c.execute(q)
-            query_result_tuples = self.c.fetchall()
+            if self.last_camis is None:
+                # the one time an offset is walked, to turn start_read into a key.
+                self.last_camis = self._window_end('', self.current) if self.current else ''
+
+            window_end = self._window_end(self.last_camis, n)
+            if window_end is None:
+                return []
+
+            # a named cursor lives on the server, so only fetch_size rows are 
+            # in memory here at a time.
+            cursor = self.conn.cursor(name = 'yelp_api_coordinator_read')
+            cursor.itersize = self.fetch_size
+            cursor.execute(self.q_window_template.format(
+                                        doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME,
+                                        yelp_restaurants_table_name = YELP_RESTAURANTS_TABLE_NAME),
+                            {'last_camis':self.last_camis, 'window_end':window_end})
+
+            # the whole window goes through one pull_restaurants call (one 
+            # progress report, one dedupe), streamed rather than fetched up front.
+            extract_tuples = self.api_interfacer.pull_restaurants(self._fetched_rows(cursor))
+
         finally:
-            self.close_conn()    
-        
-        extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
-        self.current = 0
-        return extract_tuples  
+            self.close_conn()
+
+        self.last_camis = window_end
+        return extract_tuples
+
+    def _fetched_rows(self, cursor):
+
+        query_result_tuples = cursor.fetchmany(self.fetch_size)
+        while query_result_tuples:
+            for query_result_tuple in query_result_tuples:
+                yield query_result_tuple
+            query_result_tuples = cursor.fetchmany(self.fetch_size)
+
+    def _window_end(self, last_camis, n):
+
+        self.c.execute(self.q_window_end_template.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME),
+                        {'last_camis':last_camis, 'n':n})
+        return self.c.fetchone()[0]
 
 ####--------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------####
@@ -354,128 +730,33 @@ class YelpApiFirstPassCoordinator(YelpApiCoordinator):
     def __init__(self, *args, **kwargs):
         YelpApiCoordinator.__init__(self, *args, **kwargs)
 
-        self.q_n_template = '''
+        self.q_window_template = '''
                             SELECT *
                             FROM {doh_restaurants_table_name}
-                            ORDER BY doh_camis ASC
-                            LIMIT {n} OFFSET {offset};
-                            '''
-        q_all_template =    '''
-                            SELECT *
-                            FROM {doh_restaurants_table_name}
-                            ORDER BY doh_camis ASC
-                            OFFSET {offset};
+                            WHERE doh_camis > %(last_camis)s AND doh_camis <= %(window_end)s
+                            ORDER BY doh_camis ASC;
                             '''
-    
-    # def read_next_n(self, n):
-        
-    #     if not self.conn:
-    #         self.open_conn()
-           
-    #     query = q_n_template.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME, 
-    #                                 n = n, 
-    #                                 offset = self.current)
-        
-    #     try:
-    #         self.c.execute(query)
-    #         query_result_tuples = self.c.fetchall()
-    #     finally:
-    #         self.close_conn()
-
-    #     extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
-    #     self.current += n
-    #     return extract_tuples
-         
-    # def read_all(self):
-        
-    #     if not self.conn:
-    #         self.open_conn()
-        
-    #     q = q_all_template.format(  doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME,
-    #                                 offset = self.current)
-        
-    #     try:
-    #         self.c.execute(q)
-    #         query_result_tuples = self.c.fetchall()
-    #     finally:
-    #         self.close_conn()    
-        
-    #     extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
-    #     self.current = 0
-    #     return extract_tuples
         
 ####--------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------####
 ####--------------------------------------------------------------------------------------------------####
 
 class YelpApiSecondPassCoordinator(YelpApiCoordinator):
+    '''Same batches of doh restaurants as the first pass, less those the 
+    first pass matched. The anti-join probes the yelp_restaurants primary key 
+    per row instead of re-running an EXCEPT over the whole table.
+    '''
 
     def __init__(self, *args, **kwargs):
 
         YelpApiCoordinator.__init__(self, *args, **kwargs)
 
-        self.q_all_template = ''' 
-                            SELECT * 
-                            FROM {doh_restaurants_table_name} 
-                            WHERE doh_camis in ((SELECT doh_camis 
-                                                FROM doh_restaurants
-                                                OFFSET {offset})
-                                                EXCEPT
-                                                (SELECT doh_camis FROM yelp_restaurants))
-                            ORDER BY doh_camis ASC;
-                            '''
-
-        self.q_n_template = ''' 
-                            SELECT * 
-                            FROM {doh_restaurants_table_name} 
-                            WHERE doh_camis in (  
-                                            (SELECT doh_camis 
-                                            FROM doh_restaurants
-                                            ORDER BY doh_camis
-                                            LIMIT {n} OFFSET {offset})
-                                            EXCEPT
-                                            (SELECT doh_camis FROM yelp_restaurants)  
-                                            ) 
-                            ORDER BY doh_camis ASC;
+        self.q_window_template = '''
+                            SELECT d.*
+                            FROM {doh_restaurants_table_name} AS d
+                            WHERE d.doh_camis > %(last_camis)s AND d.doh_camis <= %(window_end)s
+                                AND NOT EXISTS (SELECT 1 
+                                                FROM {yelp_restaurants_table_name} AS y
+                                                WHERE y.doh_camis = d.doh_camis)
+                            ORDER BY d.doh_camis ASC;
                             '''
-
-    
-    # def read_next_n(self, n):
-        
-    #     if not self.conn:
-    #         self.open_conn()
-           
-    #     q = self.q_n_template.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME, 
-    #                         n = n, offset = self.current)
-        
-    #     try:
-    #         self.c.execute(q)
-    #         query_result_tuples = self.c.fetchall()
-    #     finally:
-    #         self.close_conn()
-
-    #     extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
-    #     self.current += n
-    #     return extract_tuples
-         
-    # def read_all(self):
-        
-    #     if not self.conn:
-    #         self.open_conn()
-        
-    #     q = self.q_all_template.format(doh_restaurants_table_name = DOH_RESTAURANTS_TABLE_NAME, 
-    #                                     n = n,
-    #                                     offset = self.current)
-        
-    #     try:
-    #         self.c.execute(q)
-    #         query_result_tuples = self.c.fetchall()
-    #     finally:
-    #         self.close_conn()    
-        
-    #     extract_tuples = self.api_interfacer.pull_restaurants(query_result_tuples)
-    #     self.current = 0
-    #     return extract_tuples    
-
-    
-
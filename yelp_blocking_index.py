@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+from collections import defaultdict
+
+from constants import YELP_RESPONSE_CACHE_PATH, BLOCKING_MAX_BLOCK_SIZE, BLOCKING_MAX_CANDIDATES
+from yelp_api_machinery import YelpApiResponseParser
+from address_canonicalizer import AddressCanonicalizer
+
+
+class YelpBlockingIndex(object):
+    '''Index over every RestaurantYelpExtract we have seen (e.g. all the
+    responses in the response cache), to find a doh restaurant's yelp
+    candidates locally instead of with an address search.
+
+    Extracts are filed under blocking keys: each canonical street token and
+    each trigram of the name, paired with the zipcode, plus the house number
+    with the first street word (for a zipcode that disagrees). A doh
+    restaurant's candidates are the extracts sharing the most keys with it;
+    keys shared by more than max_block_size extracts say nothing and are
+    skipped.
+
+    pull_restaurants has the interfacers' signature and return value, so the
+    index can stand in for YelpApiAddressInterfacer under a coordinator, and
+    the candidates go to ByAddressExtractMatcher as usual.'''
+
+    def __init__(self, max_block_size = BLOCKING_MAX_BLOCK_SIZE, max_candidates = BLOCKING_MAX_CANDIDATES,
+                                        canonicalizer = None):
+
+        self.max_block_size = max_block_size
+        self.max_candidates = max_candidates
+        self.canonicalizer = canonicalizer or AddressCanonicalizer()
+        self.extracts = []
+        self.yelp_ids = set()
+        self.blocks = defaultdict(list)
+
+    @classmethod
+    def from_response_cache(cls, cache_path = YELP_RESPONSE_CACHE_PATH, **kwargs):
+
+        index = cls(**kwargs)
+        parser = YelpApiResponseParser()
+
+        conn = sqlite3.connect(cache_path)
+        try:
+            for (response_json,) in conn.execute('SELECT response_json FROM responses;'):
+                index.add_all(parser.parse(parser.decode(response_json)))
+        finally:
+            conn.close()
+
+        return index
+
+    def add_all(self, yelp_extracts):
+
+        for yelp_extract in yelp_extracts:
+            self.add(yelp_extract)
+
+    def add(self, yelp_extract):
+
+        if yelp_extract.yelp_id in self.yelp_ids:
+            return
+
+        self.yelp_ids.add(yelp_extract.yelp_id)
+        i = len(self.extracts)
+        self.extracts.append(yelp_extract)
+
+        for key in self._keys(yelp_extract.yelp_name, yelp_extract.yelp_address, yelp_extract.yelp_zipcode):
+            self.blocks[key].append(i)
+
+    def candidates(self, doh_extract):
+
+        shared_keys = defaultdict(int)
+        for key in self._keys(doh_extract.doh_dba, doh_extract.doh_address, doh_extract.doh_zipcode):
+
+            block = self.blocks.get(key, ())
+            if len(block) > self.max_block_size:
+                continue
+
+            for i in block:
+                shared_keys[i] += 1
+
+        best = sorted(shared_keys.iteritems(), key = lambda (i, n): (-n, i))[:self.max_candidates]
+        return [self.extracts[i] for i, _ in best]
+
+    def pull_restaurants(self, restaurants):
+
+        return [(restaurant, self.candidates(restaurant)) for restaurant in restaurants]
+
+    def _keys(self, name, address, zipcode):
+
+        keys = set()
+
+        street = (self.canonicalizer.address(address) or '').split()
+        if len(street) > 1 and street[0].isdigit():
+            keys.add(('address', street[0], street[1]))
+
+        zipcode = (zipcode or '').strip()[:5]
+        if not zipcode:
+            return keys
+
+        for token in street:
+            if not token.isdigit():
+                keys.add(('street', zipcode, token))
+
+        name = self.canonicalizer.name(name) or ''
+        for j in range(len(name) - 2):
+            keys.add(('name', zipcode, name[j:j + 3]))
+
+        return keys
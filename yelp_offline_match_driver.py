@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from constants import YELP_RESPONSE_CACHE_PATH, CHECKPOINT_BATCH_SIZE
+from yelp_api_machinery import YelpApiFirstPassCoordinator, YelpApiSecondPassCoordinator
+from yelp_blocking_index import YelpBlockingIndex
+from table_builders import YelpTablesLoader
+from extract_matchers import ByAddressExtractMatcher
+from address_canonicalizer import AddressCanonicalizer
+
+
+def build_argparser():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', help = 'Response cache holding the yelp extracts to match against.', required = False)
+    parser.add_argument('-a', '--all', help = 'Match every doh restaurant, not just those without a yelp match (with --dry_run).',
+                                        dest = 'all', action = 'store_true')
+    parser.add_argument('-d', '--dry_run', help = 'Report the matches without writing them.',
+                                        dest = 'dry_run', action = 'store_true')
+    parser.add_argument('-v', '--tfidf', help = 'Score each batch at once with n-gram tf-idf cosines (needs scipy).',
+                                        dest = 'tfidf', action = 'store_true')
+    parser.add_argument('-w', '--workers', help = 'Processes to score candidates in.', required = False)
+    parser.add_argument('-m', '--batch_size', help = 'Restaurants matched and written per batch.', required = False)
+
+    parser.set_defaults(path = YELP_RESPONSE_CACHE_PATH, all = False, dry_run = False, tfidf = False, workers = 1,
+                                        batch_size = CHECKPOINT_BATCH_SIZE * 10)
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    parser = build_argparser()
+    args = parser.parse_args()
+
+    # yelp_restaurants does not record which pass matched a row, so clearing 
+    # it for an address-only rematch would lose the phone pass' matches too.
+    if args.all and not args.dry_run:
+        parser.error('--all would rewrite restaurants already in yelp_restaurants, phone pass matches included; '
+                        'add --dry_run, or rebuild the tables with yelp_restaurant_pull_driver.py --create_table.')
+
+    # shared by the index and the matcher, so each distinct name and address
+    # is canonicalized once.
+    canonicalizer = AddressCanonicalizer()
+
+    # candidates come from every extract the pulls have cached, not from the api.
+    index = YelpBlockingIndex.from_response_cache(args.path, canonicalizer = canonicalizer)
+    print "{0} yelp extracts indexed.".format(len(index.extracts))
+
+    # after a threshold or normalization change, --all --dry_run shows how the
+    # whole city would match now.
+    coordinator_class = YelpApiFirstPassCoordinator if args.all else YelpApiSecondPassCoordinator
+    coordinator = coordinator_class(api_interfacer = index)
+
+    yelp_tables_loader = YelpTablesLoader()
+
+    if args.tfidf:
+        # imported only when asked for, so scipy stays optional.
+        from tfidf_extract_matchers import TfidfAddressExtractMatcher
+        matcher = TfidfAddressExtractMatcher(canonicalizer = canonicalizer)
+    else:
+        matcher = ByAddressExtractMatcher(canonicalizer = canonicalizer)
+    n_matched = 0
+
+    # read_batches stops at the end of doh_restaurants, so the cap is never reached.
+    for extracts, last_camis in coordinator.read_batches(float('inf'), int(args.batch_size)):
+
+        matched_extracts = matcher.match_all(extracts, n_workers = int(args.workers))
+        n_matched += len(matched_extracts)
+
+        if not args.dry_run:
+            yelp_tables_loader.add_records(matched_extracts)
+
+    print "{0} restaurants matched offline.".format(n_matched)
+    canonicalizer.report(int(args.workers))
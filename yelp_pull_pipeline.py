@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from Queue import Queue, Full, Empty
+
+from constants import CHECKPOINT_BATCH_SIZE, PIPELINE_QUEUE_SIZE
+
+
+PIPELINE_DONE = object()
+
+
+class PullPipeline(object):
+    '''Runs one pull pass as three overlapping stages: the coordinator fetches
+    batches of restaurants from the api, the matcher scores them, and the
+    loader writes them, each stage in its own thread. The queues between the
+    stages hold at most queue_size batches, so a slow stage blocks the one
+    feeding it rather than letting fetched results pile up in memory.
+
+    Batches are written in the order they were fetched, so with a pull_pass
+    the progress table checkpoints exactly as the sequential loop does.
+    n_workers is passed through to the matcher's match_all.'''
+
+    def __init__(self, coordinator, matcher, loader, pull_pass = None, batch_size = CHECKPOINT_BATCH_SIZE, 
+                                        queue_size = PIPELINE_QUEUE_SIZE, n_workers = 1):
+
+        self.coordinator = coordinator
+        self.matcher = matcher
+        self.loader = loader
+        self.pull_pass = pull_pass
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.n_workers = n_workers
+        self.stopped = threading.Event()
+
+    def run(self, n):
+
+        fetched = Queue(maxsize = self.queue_size)
+        matched = Queue(maxsize = self.queue_size)
+
+        stages = [  threading.Thread(target = self._stage, args = (self._fetch, None, fetched, n)),
+                    threading.Thread(target = self._stage, args = (self._match, fetched, matched)) ]
+
+        self.stopped.clear()
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        n_written = 0
+        try:
+            for item in iter(matched.get, PIPELINE_DONE):
+
+                if isinstance(item, Exception):
+                    raise item
+
+                matched_extracts, last_camis = item
+                self.loader.add_records(matched_extracts, self.pull_pass, last_camis)
+                n_written += len(matched_extracts)
+
+        finally:
+            # on a failure, releases stages blocked on a queue.
+            self.stopped.set()
+            for stage in stages:
+                stage.join()
+
+        return n_written
+
+    def _stage(self, work, in_queue, out_queue, *args):
+        '''Run work over in_queue's items (or args, for the first stage),
+        passing results, then any exception, then PIPELINE_DONE downstream.'''
+
+        try:
+            if in_queue is None:
+                items = work(*args)
+            else:
+                items = work(self._drain(in_queue))
+
+            for item in items:
+                if not self._put(out_queue, item):
+                    return
+
+        except Exception as e:
+            self._put(out_queue, e)
+
+        self._put(out_queue, PIPELINE_DONE)
+
+    def _put(self, queue, item):
+        '''Blocking put that gives up (returning False) once the pipeline is stopped.'''
+
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, timeout = .1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def _drain(self, in_queue):
+
+        while not self.stopped.is_set():
+
+            try:
+                item = in_queue.get(timeout = .1)
+            except Empty:
+                continue
+
+            if item is PIPELINE_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _fetch(self, n):
+
+        return self.coordinator.read_batches(n, self.batch_size)
+
+    def _match(self, fetched_batches):
+
+        for extracts, last_camis in fetched_batches:
+            yield self.matcher.match_all(extracts, n_workers = self.n_workers), last_camis
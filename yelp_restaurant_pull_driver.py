@@ -1,13 +1,26 @@
 #!/Users/rileymatthews/anaconda/bin/python
 # -*- coding: utf-8 -*-
 
+import sys
+
+if __name__ == '__main__' and ('-g' in sys.argv or '--gevent' in sys.argv):
+    # before anything below imports requests (and so socket, ssl and 
+    # threading); patched any later, the greenlets would block on real sockets.
+    from gevent import monkey
+    monkey.patch_all()
+
 import argparse
 
 from yelp_api_machinery import YelpApiPhoneInterfacer, YelpApiFirstPassCoordinator, \
-                                YelpApiAddressInterfacer, YelpApiSecondPassCoordinator
+                                YelpApiAddressInterfacer, YelpApiSecondPassCoordinator, \
+                                YelpResponseCache, QuotaBudget
 
 from table_builders import YelpRestaurantsTableBuilder, YelpCategoriesTableBuilder, \
-                            YelpNeighborhoodsTableBuilder 
+                            YelpNeighborhoodsTableBuilder, YelpTablesLoader
+
+from constants import CHECKPOINT_BATCH_SIZE
+
+from yelp_pull_pipeline import PullPipeline
 
 from extract_matchers import ByPhoneExtractMatcher, ByAddressExtractMatcher                               
 
@@ -20,8 +33,24 @@ def build_argparser():
     parser.add_argument('-r', '--report_interval', help = 'Report interval.', required = False)
     parser.add_argument('-c', '--create_table', help = 'Whether to new create a table.', dest = 'create_table', action = 'store_true')
     parser.add_argument('-s', '--search_limit', help = 'Number of results to pull per address search.', required = False)
-
-    parser.set_defaults(feature=False, report_interval = 250, search_limit = 15) 
+    parser.add_argument('-t', '--threads', help = 'Number of concurrent api requests (default 1, or 100 with --gevent).', required = False)
+    parser.add_argument('-g', '--gevent', help = 'Run the concurrent requests as greenlets rather than threads.', 
+                                        dest = 'gevent', action = 'store_true')
+    parser.add_argument('-q', '--rate', help = 'Max api requests per second (with --gevent).', required = False)
+    parser.add_argument('-b', '--daily_quota', help = 'Pace the pull to this many api requests a day (overrides --rate).', 
+                                        required = False)
+    parser.add_argument('-x', '--no_cache', help = 'Always query the api, bypassing the response cache.', 
+                                        dest = 'no_cache', action = 'store_true')
+    parser.add_argument('-k', '--checkpoint', help = 'Commit results every batch_size restaurants and resume from the last commit.', 
+                                        dest = 'checkpoint', action = 'store_true')
+    parser.add_argument('-m', '--batch_size', help = 'Restaurants per committed batch (with --checkpoint or --pipeline).', required = False)
+    parser.add_argument('-w', '--workers', help = 'Processes to score second pass (by address) candidates in.', required = False)
+    parser.add_argument('-p', '--pipeline', help = 'Overlap fetching, matching and writing batches.', 
+                                        dest = 'pipeline', action = 'store_true')
+
+    parser.set_defaults(feature=False, report_interval = 250, search_limit = 15, threads = None, gevent = False, rate = 10, 
+                                        no_cache = False, checkpoint = False, pipeline = False, batch_size = CHECKPOINT_BATCH_SIZE, 
+                                        workers = 1) 
 
     return parser  
 
@@ -36,48 +65,109 @@ if __name__ == '__main__':
     report_interval = int(args.report_interval) if args.report_interval else 250
     create_table = args.create_table
     limit = args.search_limit if args.search_limit else 15
+    n_threads = int(args.threads) if args.threads else None
+    response_cache = None if args.no_cache else YelpResponseCache()
+    rate_limiter = QuotaBudget(int(args.daily_quota)) if args.daily_quota else None
+    n_workers = int(args.workers)
+
+    if args.gevent:
+
+        # a single greenlet would take the serial pull path, and the pool would never run.
+        if n_threads is not None and n_threads < 2:
+            parser.error('--gevent needs at least 2 concurrent requests; leave out --threads for 100.')
+
+        # imported only when asked for; the standard library was patched above.
+        from yelp_api_gevent import GeventYelpApiPhoneInterfacer, GeventYelpApiAddressInterfacer
+
+        # without --threads, the interfacers' own max_concurrency default.
+        concurrency = {'max_concurrency': n_threads} if n_threads else {}
+
+        api_phone_interfacer = GeventYelpApiPhoneInterfacer(requests_per_second = float(args.rate), 
+                                        report_interval = report_interval, response_cache = response_cache, 
+                                        rate_limiter = rate_limiter, **concurrency)
+        api_address_interfacer = GeventYelpApiAddressInterfacer(requests_per_second = float(args.rate), 
+                                        limit = limit, sort = 1, report_interval = report_interval, 
+                                        response_cache = response_cache, rate_limiter = rate_limiter, **concurrency)
+    else:
+        n_threads = n_threads or 1
+        api_phone_interfacer = YelpApiPhoneInterfacer(report_interval = report_interval, n_threads = n_threads, 
+                                        response_cache = response_cache, rate_limiter = rate_limiter)
+        api_address_interfacer = YelpApiAddressInterfacer(limit = limit, sort = 1, report_interval = report_interval, 
+                                        n_threads = n_threads, response_cache = response_cache, 
+                                        rate_limiter = rate_limiter)
 
 
-    yelp_restuarants_tb = YelpRestaurantsTableBuilder()
-    yelp_categories_tb = YelpCategoriesTableBuilder()
-    yelp_neighborhoods_tb = YelpNeighborhoodsTableBuilder()
+    first_coordinator = YelpApiFirstPassCoordinator(api_interfacer = api_phone_interfacer, start_read = offset)
+    second_coordinator = YelpApiSecondPassCoordinator(api_interfacer = api_address_interfacer, start_read = offset)
 
+    if args.checkpoint or args.pipeline:
 
-    api_phone_interfacer = YelpApiPhoneInterfacer(report_interval = report_interval)
-    first_coordinator = YelpApiFirstPassCoordinator(api_interfacer = api_phone_interfacer, start_read = offset)
+        # each batch's results (and with --checkpoint the pass' position) commit 
+        # together, so a restarted run picks up after the last committed batch 
+        # (ignoring offset).
+        yelp_tables_loader = YelpTablesLoader()
 
+        if create_table:
+            yelp_tables_loader.create_tables()
+        else:
+            yelp_tables_loader.progress_tb.ensure_table()
 
-    # first pass
+        # phone matches are single candidate lookups, too cheap to ship to a pool.
+        passes = [  ('first', first_coordinator, ByPhoneExtractMatcher(), 1),
+                    ('second', second_coordinator, ByAddressExtractMatcher(), n_workers) ]
 
-    extracts = first_coordinator.read_next_n(n = n_pull)
-    matched_extracts = ByPhoneExtractMatcher().match_all(extracts)
+        for pull_pass, coordinator, matcher, pass_workers in passes:
 
-    if create_table:
+            # without --checkpoint, batches commit but no position is recorded.
+            checkpoint_pass = pull_pass if args.checkpoint else None
 
-        yelp_restuarants_tb.create_table()
-        yelp_categories_tb.create_table()
-        yelp_neighborhoods_tb.create_table()
+            if args.checkpoint:
+                last_camis = yelp_tables_loader.progress_tb.last_camis(pull_pass)
+                if last_camis is not None:
+                    print "Resuming {0} pass after doh_camis {1}.".format(pull_pass, last_camis)
+                    coordinator.last_camis = last_camis
 
-    yelp_restuarants_tb.add_records(matched_extracts)
-    yelp_categories_tb.add_records(matched_extracts)
-    yelp_neighborhoods_tb.add_records(matched_extracts)            
+            if args.pipeline:
+                # the second pass still starts only once the first is written, 
+                # since it skips the restaurants the first pass matched.
+                PullPipeline(coordinator, matcher, yelp_tables_loader, pull_pass = checkpoint_pass, 
+                                        batch_size = int(args.batch_size), n_workers = pass_workers).run(n_pull)
+            else:
+                for extracts, last_camis in coordinator.read_batches(n_pull, int(args.batch_size)):
+                    yelp_tables_loader.add_records(matcher.match_all(extracts, n_workers = pass_workers), 
+                                        checkpoint_pass, last_camis)
 
-    # second pass
+            if coordinator is first_coordinator:
+                api_phone_interfacer.report_dedupe_savings()
 
-    api_address_interfacer = YelpApiAddressInterfacer(limit = limit, sort = 1, report_interval = report_interval)
-    second_coordinator = YelpApiSecondPassCoordinator(api_interfacer = api_address_interfacer, start_read = offset)
-    
-    extracts = second_coordinator.read_next_n(n = n_pull)
-    matched_extracts = ByAddressExtractMatcher().match_all(extracts)
+    else:
+
+        yelp_restuarants_tb = YelpRestaurantsTableBuilder()
+        yelp_categories_tb = YelpCategoriesTableBuilder()
+        yelp_neighborhoods_tb = YelpNeighborhoodsTableBuilder()
+
+        # first pass
 
+        extracts = first_coordinator.read_next_n(n = n_pull)
+        matched_extracts = ByPhoneExtractMatcher().match_all(extracts)
+        api_phone_interfacer.report_dedupe_savings()
 
-    yelp_restuarants_tb.add_records(matched_extracts)
-    yelp_categories_tb.add_records(matched_extracts)
-    yelp_neighborhoods_tb.add_records(matched_extracts)    
+        if create_table:
 
-    
+            yelp_restuarants_tb.create_table()
+            yelp_categories_tb.create_table()
+            yelp_neighborhoods_tb.create_table()
 
-    
+        yelp_restuarants_tb.add_records(matched_extracts)
+        yelp_categories_tb.add_records(matched_extracts)
+        yelp_neighborhoods_tb.add_records(matched_extracts)            
 
+        # second pass
+        
+        extracts = second_coordinator.read_next_n(n = n_pull)
+        matched_extracts = ByAddressExtractMatcher().match_all(extracts, n_workers = n_workers)
 
 
+        yelp_restuarants_tb.add_records(matched_extracts)
+        yelp_categories_tb.add_records(matched_extracts)
+        yelp_neighborhoods_tb.add_records(matched_extracts)    